@@ -0,0 +1,28 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.utils.translation import gettext_lazy as _
+
+from bazis.core.utils.apps import BaseConfig
+
+
+class BulkConfig(BaseConfig):
+    """
+    Configuration of the bulk application. The application is added to INSTALLED_APPS
+    to store the results of the packages with the idempotency keys
+    """
+
+    name = 'bazis.contrib.bulk'
+    default_auto_field = 'django.db.models.BigAutoField'
+    verbose_name = _('Bulk requests')
@@ -0,0 +1,164 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from typing import Any
+
+from django.apps import apps
+from django.conf import settings
+
+from fastapi import Cookie, Depends, FastAPI, Query, Request
+from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
+
+from starlette.concurrency import run_in_threadpool
+
+from bazis.core.errors import JsonApi401Exception
+
+
+LOG = logging.getLogger(__name__)
+
+# the key of the scope state under which the identity of the package request is passed
+BULK_IDENTITY = 'bazis_bulk_identity'
+
+
+def users_service_get():
+    """
+    Returns the service module of bazis-users, if the application is installed
+    """
+    if not apps.is_installed('bazis.contrib.users'):
+        return None
+    from bazis.contrib.users import service
+
+    return service
+
+
+class BulkIdentity:
+    """
+    The identity of the package request. If the token of the package request is invalid,
+    the error is raised in each sub-request, as it would be raised without the bulk
+    """
+
+    def __init__(
+        self, token_data: dict | None = None, user: Any = None, error: Exception | None = None
+    ):
+        self.token_data = token_data or {}
+        self.user = user
+        self.error = error
+
+    def token_data_get(self) -> dict:
+        if self.error:
+            raise self.error
+        return self.token_data
+
+    def user_get(self) -> Any:
+        if self.error:
+            raise self.error
+        return self.user
+
+
+def identity_owner(identity: BulkIdentity | None) -> str:
+    """
+    Returns the key of the user of the package request, empty for an anonymous request
+    """
+    user = identity.user if identity and not identity.error else None
+    return str(user.pk) if getattr(user, 'pk', None) else ''
+
+
+def identity_tenant(identity: BulkIdentity | None) -> str:
+    """
+    Returns the key of the tenant of the package request: the token claim set by the settings
+    or, without it, the user
+    """
+    claim = settings.BAZIS_BULK_TENANT_CLAIM
+    if claim and identity and not identity.error:
+        if (tenant := identity.token_data.get(claim)) is not None:
+            return str(tenant)
+    return identity_owner(identity)
+
+
+def identity_from_scope(request: Request) -> BulkIdentity | None:
+    """
+    Returns the identity passed by the bulk route into the sub-request scope
+    """
+    return request.scope.get('state', {}).get(BULK_IDENTITY)
+
+
+async def identity_resolve(request: Request) -> BulkIdentity | None:
+    """
+    Resolves the identity of the package request: the token is taken the same way as
+    bazis-users does - from the query parameter, the Authorization header or the cookie
+    """
+    if not (service := users_service_get()):
+        return None
+
+    scheme, token_header = get_authorization_scheme_param(request.headers.get('Authorization'))
+    if scheme.lower() != 'bearer':
+        token_header = None
+
+    try:
+        token_data = service.get_token_data(
+            token_header=token_header or None,
+            token_param=request.query_params.get(settings.BAZIS_AUTH_COOKIE_NAME),
+            token_cookie=request.cookies.get(settings.BAZIS_AUTH_COOKIE_NAME),
+        )
+    except JsonApi401Exception as exc:
+        return BulkIdentity(error=exc)
+
+    user = await run_in_threadpool(service.get_user_from_token, token_data)
+    return BulkIdentity(token_data=token_data, user=user)
+
+
+def identity_overrides_install(app: FastAPI) -> None:
+    """
+    Overrides the token dependencies of bazis-users. Inside a sub-request they return the identity
+    that the bulk route passed through the scope state (a client cannot set it), instead of
+    decoding the token and loading the user again. Outside the bulk the original dependencies are called.
+    The dependencies already overridden by the project are not replaced, with a warning
+    """
+    if not (service := users_service_get()):
+        return
+
+    def token_data_get(
+        request: Request,
+        token_header: str = Depends(
+            OAuth2PasswordBearer(tokenUrl=settings.BAZIS_OPENAPI_TOKEN_URL, auto_error=False)
+        ),
+        token_param: str | None = Query(default=None, alias=settings.BAZIS_AUTH_COOKIE_NAME),
+        token_cookie: str | None = Cookie(default=None, alias=settings.BAZIS_AUTH_COOKIE_NAME),
+    ) -> dict:
+        if identity := identity_from_scope(request):
+            return identity.token_data_get()
+        return service.get_token_data(token_header, token_param, token_cookie)
+
+    def user_from_token_get(
+        request: Request, token_data: dict = Depends(service.get_token_data)
+    ) -> Any:
+        if identity := identity_from_scope(request):
+            return identity.user_get()
+        return service.get_user_from_token(token_data)
+
+    for dependency, override in (
+        (service.get_token_data, token_data_get),
+        (service.get_user_from_token, user_from_token_get),
+    ):
+        if (existing := app.dependency_overrides.get(dependency)) is None:
+            app.dependency_overrides[dependency] = override
+        # the override of the project is kept, but the sub-requests lose the identity with it
+        elif getattr(existing, '__module__', None) != __name__:
+            LOG.warning(
+                'The %s dependency is already overridden, the sub-requests of the bulk packages '
+                'will not receive the identity of the package request',
+                dependency.__name__,
+            )
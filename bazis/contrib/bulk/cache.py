@@ -0,0 +1,72 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import Callable, Hashable
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from typing import Any
+
+
+bulk_cache_var: ContextVar['BulkCache | None'] = ContextVar('bulk_cache', default=None)
+
+
+class BulkCache:
+    """
+    Memoization storage of a single package. It is created when the thread behavior
+    of the package is entered and is cleared when the package is finished.
+    All the package items are executed with the same identity, so the values do not leak
+    between users. Sub-requests may run in different threads, so the storage is locked
+    """
+
+    def __init__(self):
+        self.store = {}
+        self.lock = Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.store:
+                return self.store[key]
+        # the factory is called outside the lock: it may take long or use the cache itself
+        value = factory()
+        with self.lock:
+            return self.store.setdefault(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.store.clear()
+
+
+def bulk_cache_get(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """
+    Returns the value from the cache of the current package, calculating it with the factory
+    on the first call. Outside the package the factory is called every time
+    """
+    if (cache := bulk_cache_var.get()) is None:
+        return factory()
+    return cache.get(key, factory)
+
+
+def bulk_cached(func: Callable) -> Callable:
+    """
+    Decorator that memoizes the function result within the current package.
+    The arguments of the function must be hashable
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__module__, func.__qualname__, args, frozenset(kwargs.items()))
+        return bulk_cache_get(key, lambda: func(*args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,193 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Literal
+
+from django.utils.translation import gettext_lazy as _
+
+from pydantic import Field
+
+from bazis.core.utils.schemas import BazisSettings
+
+
+class Settings(BazisSettings):
+    """
+    Settings of the bulk requests
+    """
+
+    BAZIS_BULK_MIDDLEWARES_SKIP: list[str] = Field(
+        [
+            'bazis.core.app.CloseOldConnectionsMiddleware',
+            'starlette.middleware.cors.CORSMiddleware',
+        ],
+        title=_('Middlewares that are not applied to the sub-requests of a package'),
+    )
+
+    BAZIS_BULK_PREFETCH: int = Field(
+        8, title=_('Number of the package items prepared ahead of the executed one')
+    )
+
+    BAZIS_BULK_SPOOL_SIZE: int = Field(
+        8 * 1024 * 1024,
+        title=_('Size of the package results kept in memory, larger ones are spilled to disk'),
+    )
+
+    BAZIS_BULK_ITEM_BUFFER_SIZE: int = Field(
+        1024 * 1024,
+        title=_('Size of a sub-response kept in memory, larger ones are spilled to disk'),
+    )
+
+    BAZIS_BULK_PREFLIGHT: bool = Field(
+        True, title=_('Validate the items of an atomic package before opening the transaction')
+    )
+
+    BAZIS_BULK_ISOLATION_LEVEL: (
+        Literal['read_committed', 'repeatable_read', 'serializable'] | None
+    ) = Field(None, title=_('Default isolation level of the package transaction'))
+    BAZIS_BULK_LOCK_TIMEOUT: int | None = Field(
+        None, title=_('Default lock timeout of the package transaction, ms')
+    )
+    BAZIS_BULK_LOCK_TIMEOUT_MAX: int | None = Field(
+        None, title=_('Maximum lock timeout of the package transaction, ms')
+    )
+    BAZIS_BULK_STATEMENT_TIMEOUT: int | None = Field(
+        None, title=_('Default statement timeout of the package transaction, ms')
+    )
+    BAZIS_BULK_STATEMENT_TIMEOUT_MAX: int | None = Field(
+        None, title=_('Maximum statement timeout of the package transaction, ms')
+    )
+    BAZIS_BULK_IDLE_TIMEOUT: int | None = Field(
+        None, title=_('Default idle in transaction session timeout of the package, ms')
+    )
+    BAZIS_BULK_IDLE_TIMEOUT_MAX: int | None = Field(
+        None, title=_('Maximum idle in transaction session timeout of the package, ms')
+    )
+
+    BAZIS_BULK_DEADLINE: int | None = Field(None, title=_('Default deadline of the package, ms'))
+    BAZIS_BULK_DEADLINE_MAX: int | None = Field(
+        None, title=_('Maximum deadline of the package, ms')
+    )
+    BAZIS_BULK_ITEM_TIMEOUT: int | None = Field(
+        None, title=_('Default timeout of a package item, ms')
+    )
+    BAZIS_BULK_ITEM_TIMEOUT_MAX: int | None = Field(
+        None, title=_('Maximum timeout of a package item, ms')
+    )
+
+    BAZIS_BULK_IMPORT_BATCH_SIZE: int = Field(
+        500, title=_('Default number of the rows of the imported file executed as a batch')
+    )
+    BAZIS_BULK_IMPORT_BATCH_SIZE_MAX: int = Field(
+        5000, title=_('Maximum number of the rows of the imported file executed as a batch')
+    )
+
+    BAZIS_BULK_COST_WEIGHTS: dict[str, float] = Field(
+        {},
+        title=_('Cost weights of the routes by the method and the path, the path or the method'),
+    )
+    BAZIS_BULK_COST_DEFAULT: float = Field(1.0, title=_('Cost weight of the other routes'))
+    BAZIS_BULK_COST_UNIT: float = Field(
+        10.0, title=_('Average duration of a sub-request that does not increase its cost, ms')
+    )
+    BAZIS_BULK_COST_INCLUDE_FACTOR: float = Field(
+        0.5, title=_('Increase of the cost of a sub-request by each included relation')
+    )
+    BAZIS_BULK_COST_USER_RATE: float | None = Field(
+        None, title=_('Cost budget of a user, units per second')
+    )
+    BAZIS_BULK_COST_USER_BURST: float = Field(
+        1000.0, title=_('Cost reserve of the budget of a user, units')
+    )
+    BAZIS_BULK_COST_GLOBAL_RATE: float | None = Field(
+        None, title=_('Global cost budget, units per second')
+    )
+    BAZIS_BULK_COST_GLOBAL_BURST: float = Field(
+        10000.0, title=_('Cost reserve of the global budget, units')
+    )
+    BAZIS_BULK_COST_WAIT: int = Field(
+        0, title=_('Maximum wait of a package for the cost budget before it is rejected, ms')
+    )
+
+    BAZIS_BULK_SCHEDULER_SLOTS: int | None = Field(
+        None, title=_('Number of the sub-requests of all the packages executed at once')
+    )
+    BAZIS_BULK_SCHEDULER_SHARES: dict[str, float] = Field(
+        {}, title=_('Shares of the slots of the scheduler by the tenants')
+    )
+    BAZIS_BULK_SCHEDULER_SHARE_DEFAULT: float = Field(
+        1.0, title=_('Share of the slots of the scheduler of the other tenants')
+    )
+    BAZIS_BULK_TENANT_CLAIM: str | None = Field(
+        None, title=_('Claim of the token that identifies the tenant, by default the user')
+    )
+
+    BAZIS_BULK_THREADS: int | None = Field(
+        40,
+        title=_('Number of the worker threads of the sub-requests of the packages at once'),
+    )
+
+    BAZIS_BULK_PROCESSES: int | None = Field(
+        None, title=_('Number of the worker processes of the large reading packages')
+    )
+    BAZIS_BULK_PROCESSES_ITEMS_MIN: int = Field(
+        200, title=_('Minimum number of the items of a package executed by the worker processes')
+    )
+    BAZIS_BULK_PROCESSES_SHARD_SIZE: int = Field(
+        50, title=_('Number of the items of a package executed by a worker process at once')
+    )
+
+    BAZIS_BULK_GROUPS_CONCURRENCY: int = Field(
+        4, title=_('Number of the groups of the items of a package executed at once')
+    )
+
+    BAZIS_BULK_LANES: dict[str, int] = Field(
+        {},
+        title=_('Number of the packages executed at once by the lanes'),
+    )
+    BAZIS_BULK_LANE_INTERACTIVE_ITEMS: int = Field(
+        10, title=_('Maximum number of the sub-requests of a package of the interactive lane')
+    )
+
+    BAZIS_BULK_DIAGNOSTICS: bool = Field(
+        False, title=_('Allow the packages to report the SQL statements of their items')
+    )
+    BAZIS_BULK_DIAGNOSTICS_REPEATS: int = Field(
+        5, title=_('Number of the executions of a statement shape reported as repeated')
+    )
+
+    BAZIS_BULK_RETRIES: int = Field(
+        0, title=_('Default number of the retries of an atomic package on a serialization failure')
+    )
+    BAZIS_BULK_RETRIES_MAX: int = Field(
+        5, title=_('Maximum number of the retries of an atomic package')
+    )
+    BAZIS_BULK_RETRY_DELAY: int = Field(50, title=_('Base delay before the retry, ms'))
+    BAZIS_BULK_RETRY_DELAY_MAX: int = Field(2000, title=_('Maximum delay before the retry, ms'))
+    BAZIS_BULK_RETRY_BUDGET: int = Field(
+        20, title=_('Number of the retries available to the process at once')
+    )
+    BAZIS_BULK_RETRY_BUDGET_RATIO: float = Field(
+        0.1, title=_('Part of a retry returned to the budget by a package without retries')
+    )
+
+    BAZIS_BULK_IDEMPOTENCY_TTL: int = Field(
+        86400, title=_('Lifetime of the stored results of the packages with idempotency keys, s')
+    )
+    BAZIS_BULK_IDEMPOTENCY_WAIT: bool = Field(
+        True,
+        title=_('Wait for the in-flight package with the same idempotency key'),
+    )
+
+
+settings = Settings()
@@ -0,0 +1,269 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import math
+import time
+from collections.abc import AsyncIterator, Sequence
+from threading import Lock
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from fastapi import FastAPI, HTTPException
+
+from starlette.routing import BaseRoute
+
+from . import schemas
+from .dispatch import route_scope_resolve
+from .metrics import bulk_metrics
+
+
+# weight of the new duration in the learned average
+COST_AVERAGE_ALPHA = 0.1
+# number of the buckets of the users after which the full ones are dropped
+COST_BUCKETS_MAX = 10000
+
+
+def route_key(method: str, route: BaseRoute | None, path: str) -> str:
+    """
+    Returns the key of the cost of a sub-request: the method and the path template of its route
+    """
+    return f'{method} {getattr(route, "path", None) or path}'
+
+
+class CostModel:
+    """
+    Learned average durations of the sub-requests by their routes
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.averages = {}
+        # the durations observed by a worker process, sent back to the process of the package
+        self.observations = None
+
+    def observe(self, key: str, duration: float):
+        with self.lock:
+            if self.observations is not None:
+                self.observations.append((key, duration))
+            average = self.averages.get(key)
+            self.averages[key] = (
+                duration if average is None else average + COST_AVERAGE_ALPHA * (duration - average)
+            )
+
+    def average_get(self, key: str) -> float | None:
+        with self.lock:
+            return self.averages.get(key)
+
+    def reset(self):
+        with self.lock:
+            self.averages.clear()
+
+
+cost_model = CostModel()
+
+
+def weight_get(method: str, key: str) -> float:
+    """
+    Returns the weight of the route from the settings: by the method and the path template,
+    by the path template or by the method
+    """
+    weights = settings.BAZIS_BULK_COST_WEIGHTS
+    for name in (key, key.split(' ', 1)[1], method):
+        if name in weights:
+            return weights[name]
+    return settings.BAZIS_BULK_COST_DEFAULT
+
+
+def item_cost(app: FastAPI, endpoint: str, method: str) -> float:
+    """
+    Estimates the cost of a sub-request: the weight of its route, multiplied by the learned
+    average duration, by the requested page size and by the number of the included relations
+    """
+    method = method.upper()
+    url = urlparse(endpoint)
+    resolved = route_scope_resolve(app.router, {'type': 'http', 'path': url.path, 'method': method})
+    key = route_key(method, resolved and resolved[0], url.path)
+
+    cost = weight_get(method, key)
+    if (average := cost_model.average_get(key)) is not None:
+        cost *= max(average * 1000 / settings.BAZIS_BULK_COST_UNIT, 1)
+
+    query = parse_qs(url.query)
+    if limit := query.get('page[limit]'):
+        try:
+            cost *= max(int(limit[0]) / settings.BAZIS_API_PAGINATION_PAGE_SIZE_DEFAULT, 1)
+        except ValueError:
+            pass
+    if include := query.get('include'):
+        relations = [it for it in include[0].split(',') if it]
+        cost *= 1 + settings.BAZIS_BULK_COST_INCLUDE_FACTOR * len(relations)
+
+    return cost
+
+
+def items_cost(app: FastAPI, items: Sequence[schemas.BulkPackageItemSchema]) -> float:
+    """
+    Estimates the cost of the package, the bodies of a batch item cost the same
+    """
+    cost = 0.0
+    for item in items:
+        count = len(item.bodies) if isinstance(item, schemas.BulkBatchItemSchema) else 1
+        cost += item_cost(app, item.endpoint, item.method) * count
+    return cost
+
+
+class CostBucket:
+    """
+    Token bucket of the cost: `rate` units per second, up to `burst` units in reserve.
+    The units may be reserved ahead, then the bucket goes negative and the next packages wait
+    """
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.time = now
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.time) * self.rate)
+        self.time = now
+
+    def wait_get(self, cost: float) -> float:
+        """
+        Returns the time after which the cost is covered, seconds
+        """
+        return max(cost - self.tokens, 0) / self.rate
+
+
+class CostBudget:
+    """
+    Process-wide cost budgets: one per user and the global one. A package is charged against both
+    before it is executed
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.buckets = {}
+        self.bucket_global = None
+
+    def _bucket_get(self, owner: str, now: float) -> CostBucket | None:
+        if settings.BAZIS_BULK_COST_USER_RATE is None:
+            return None
+        if (bucket := self.buckets.get(owner)) is None:
+            if len(self.buckets) >= COST_BUCKETS_MAX:
+                for key, it in list(self.buckets.items()):
+                    it.refill(now)
+                    if it.tokens >= it.burst:
+                        del self.buckets[key]
+            bucket = self.buckets[owner] = CostBucket(
+                settings.BAZIS_BULK_COST_USER_RATE, settings.BAZIS_BULK_COST_USER_BURST, now
+            )
+        return bucket
+
+    def _bucket_global_get(self, now: float) -> CostBucket | None:
+        if settings.BAZIS_BULK_COST_GLOBAL_RATE is None:
+            return None
+        if self.bucket_global is None:
+            self.bucket_global = CostBucket(
+                settings.BAZIS_BULK_COST_GLOBAL_RATE, settings.BAZIS_BULK_COST_GLOBAL_BURST, now
+            )
+        return self.bucket_global
+
+    @property
+    def is_enabled(self) -> bool:
+        return (
+            settings.BAZIS_BULK_COST_USER_RATE is not None
+            or settings.BAZIS_BULK_COST_GLOBAL_RATE is not None
+        )
+
+    def reserve(self, owner: str, cost: float, wait_max: float) -> tuple[bool, float]:
+        """
+        Reserves the cost in the budgets of the user and the global one, if it is covered
+        within the maximum wait. Returns whether it is reserved and the time to wait, seconds.
+        The infinite time means that the cost is never covered: it exceeds the full reserve
+        of a budget with the units added during the maximum wait
+        """
+        now = time.monotonic()
+        with self.lock:
+            buckets = [
+                it
+                for it in (self._bucket_get(owner, now), self._bucket_global_get(now))
+                if it is not None
+            ]
+            if any(cost > bucket.burst + bucket.rate * wait_max for bucket in buckets):
+                return False, math.inf
+            for bucket in buckets:
+                bucket.refill(now)
+            wait = max((bucket.wait_get(cost) for bucket in buckets), default=0.0)
+            if wait > wait_max:
+                return False, wait
+            for bucket in buckets:
+                bucket.tokens -= cost
+            return True, wait
+
+    def reset(self):
+        with self.lock:
+            self.buckets.clear()
+            self.bucket_global = None
+
+
+cost_budget = CostBudget()
+
+
+async def cost_charge(app: FastAPI, owner: str, items: Sequence[schemas.BulkPackageItemSchema]):
+    """
+    Charges the cost of the package against the budgets. The package that fits into the budgets
+    within the maximum wait is queued, the other one is rejected with the 429 status.
+    The package that never fits into the budgets is rejected with the 413 status
+    """
+    if not cost_budget.is_enabled:
+        return
+
+    cost = items_cost(app, items)
+    bulk_metrics.observe('packages_cost', cost)
+
+    wait_max = settings.BAZIS_BULK_COST_WAIT / 1000
+    is_reserved, wait = cost_budget.reserve(owner, cost, wait_max)
+    if not is_reserved:
+        bulk_metrics.inc('packages_cost_rejected')
+        if math.isinf(wait):
+            raise HTTPException(
+                status_code=413,
+                detail=_('The cost of the package exceeds the capacity of the budget'),
+            )
+        raise HTTPException(
+            status_code=429,
+            detail=_('The cost of the package exceeds the budget'),
+            headers={'Retry-After': str(max(math.ceil(wait), 1))},
+        )
+    if wait:
+        bulk_metrics.inc('packages_cost_queued')
+        bulk_metrics.observe('packages_cost_wait', wait)
+        await asyncio.sleep(wait)
+
+
+async def batches_charge(
+    app: FastAPI,
+    owner: str,
+    batches: AsyncIterator[list[schemas.BulkRequestItemSchema]],
+) -> AsyncIterator[list[schemas.BulkRequestItemSchema]]:
+    """
+    Charges the cost of every batch of the import before it is executed
+    """
+    async for items in batches:
+        await cost_charge(app, owner, items)
+        yield items
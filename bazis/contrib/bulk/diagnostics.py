@@ -0,0 +1,85 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+import time
+from collections import Counter
+
+from .metrics import bulk_metrics
+
+
+# the literals and the placeholders of the parameters are replaced by the same mark
+SQL_STRING = re.compile(r"'(?:[^']|'')*'")
+SQL_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+SQL_PARAM = re.compile(r'%s|%\(\w+\)s')
+# the lists of the parameters differ by the length only
+SQL_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SQL_SPACE = re.compile(r'\s+')
+
+
+def sql_normalize(sql: str) -> str:
+    """
+    Returns the shape of the SQL statement: the statements that differ by the values only,
+    such as the queries of the related objects of every row, have the same shape
+    """
+    sql = SQL_STRING.sub('?', sql)
+    sql = SQL_NUMBER.sub('?', sql)
+    sql = SQL_PARAM.sub('?', sql)
+    sql = SQL_LIST.sub('(...)', sql)
+    return SQL_SPACE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """
+    Execute wrapper of the database connection that records the statements of a sub-request.
+    It is installed on the connection of the dedicated thread, so the statements of the sub-requests
+    executed one after another are recorded separately
+    """
+
+    def __init__(self):
+        self.shapes = Counter()
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        time_start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - time_start
+            self.count += 1
+            self.shapes[sql_normalize(sql)] += 1
+
+    def clear(self):
+        self.shapes.clear()
+        self.count = 0
+        self.duration = 0.0
+
+    def report(self, repeats: int) -> dict:
+        """
+        Returns the report of the recorded statements. The shapes executed at least `repeats` times
+        are flagged as repeated, the most frequent first
+        """
+        repeated = [
+            {'sql': shape, 'count': count}
+            for shape, count in self.shapes.most_common()
+            if count >= repeats
+        ]
+        if repeated:
+            bulk_metrics.inc('items_queries_repeated')
+        return {
+            'queries': self.count,
+            'duration_ms': round(self.duration * 1000, 3),
+            'repeated': repeated,
+        }
@@ -0,0 +1,118 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from functools import cache
+
+from django.conf import settings
+
+from fastapi import FastAPI
+from fastapi.middleware.asyncexitstack import AsyncExitStackMiddleware
+
+from starlette.middleware.exceptions import ExceptionMiddleware
+from starlette.routing import BaseRoute, Match, Router
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+# key of the sub-request scope with the route resolved for a batch of the package
+SCOPE_ROUTE = 'bulk_route'
+
+
+def middleware_path(cls) -> str:
+    return f'{cls.__module__}.{cls.__qualname__}'
+
+
+def exception_handlers_get(app: FastAPI) -> dict:
+    """
+    Returns the exception handlers of the application that render the errors of the sub-requests
+    """
+    return {
+        key: value for key, value in app.exception_handlers.items() if key not in (500, Exception)
+    }
+
+
+def route_scope_resolve(router: Router, scope: Scope) -> tuple[BaseRoute, Scope] | None:
+    """
+    Returns the route that fully matches the sub-request and the scope it adds
+    """
+    for route in router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route, child_scope
+    return None
+
+
+class RouterResolved:
+    """
+    Router of the sub-requests. The sub-requests of a batch are handled by the route resolved
+    once for the batch, the other ones are routed as usual
+    """
+
+    def __init__(self, router: Router):
+        self.router = router
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (resolved := scope.get(SCOPE_ROUTE)) is None:
+            await self.router(scope, receive, send)
+            return
+        route, child_scope = resolved
+        scope.setdefault('router', self.router)
+        scope.update(child_scope)
+        await route.handle(scope, receive, send)
+
+
+@cache
+def app_bulk_build(app: FastAPI, middlewares_skip: tuple[str, ...]) -> ASGIApp:
+    """
+    Builds the middleware stack of the sub-requests. It is the stack of the application without
+    the middlewares that are already applied to the package request and only add thread hops
+    to each item (such as closing old connections in the thread pool). Sync routes and sync
+    dependencies are still executed in the worker thread, async ones are awaited on the event
+    loop without any thread handoff.
+    ServerErrorMiddleware is not applied: an unhandled error of an item is raised to the package
+    """
+    asgi_app = ExceptionMiddleware(
+        AsyncExitStackMiddleware(RouterResolved(app.router)),
+        handlers=exception_handlers_get(app),
+        debug=app.debug,
+    )
+
+    for cls, args, kwargs in reversed(app.user_middleware):
+        if middleware_path(cls) not in middlewares_skip:
+            asgi_app = cls(asgi_app, *args, **kwargs)
+
+    return asgi_app
+
+
+def app_bulk_get(app: FastAPI) -> ASGIApp:
+    """
+    Returns the ASGI application through which the sub-requests of a package are dispatched
+    """
+    return app_bulk_build(app, tuple(settings.BAZIS_BULK_MIDDLEWARES_SKIP))
+
+
+async def exception_dispatch(app: FastAPI, scope: Scope, exc: Exception, send: Send) -> None:
+    """
+    Renders the exception as the response of a sub-request with the exception handlers
+    of the application, the same way as if it was raised by the route
+    """
+
+    async def app_raise(_scope: Scope, _receive: Receive, _send: Send):
+        raise exc
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    await ExceptionMiddleware(app_raise, handlers=exception_handlers_get(app), debug=app.debug)(
+        scope, receive, send
+    )
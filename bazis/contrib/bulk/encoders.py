@@ -0,0 +1,161 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import json
+import re
+from collections.abc import Callable, Iterator
+from typing import IO, Any
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_dumps(data: Any) -> bytes:
+    """
+    Serializes the data to JSON bytes. orjson is used if it is installed,
+    the data it can not serialize, such as integers above 64 bits, fall back to the standard library
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(
+        data,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+# orjson turns the integers above 64 bits into floats silently, such integers have 19 digits at least
+JSON_LONG_DIGITS = re.compile(r'\d{19}')
+JSON_LONG_DIGITS_BYTES = re.compile(rb'\d{19}')
+
+
+def json_loads(data: bytes | str) -> Any:
+    """
+    Deserializes JSON bytes. orjson is used if it is installed, the data with the long runs
+    of digits, which may be the integers above 64 bits, are parsed by the standard library
+    """
+    if orjson is not None:
+        pattern = JSON_LONG_DIGITS if isinstance(data, str) else JSON_LONG_DIGITS_BYTES
+        if not pattern.search(data):
+            return orjson.loads(data)
+    return json.loads(data)
+
+
+def headers_decode(headers: list[tuple[bytes, bytes]] | None) -> list[tuple[str, str]]:
+    """
+    Converts ASGI headers into string pairs
+    """
+    return [(name.decode('latin-1'), value.decode('latin-1')) for name, value in headers or ()]
+
+
+# size of the chunks the spilled sub-response bodies are read with, bytes
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def body_chunks(body: bytes | bytearray | IO[bytes] | None) -> Iterator[bytes]:
+    """
+    Yields the body of a sub-response: the buffered body as is,
+    the body spilled to a temporary file by chunks
+    """
+    if body is None:
+        return
+    if isinstance(body, bytes | bytearray):
+        if body:
+            yield body
+        return
+    body.seek(0)
+    while chunk := body.read(BODY_CHUNK_SIZE):
+        yield chunk
+
+
+def body_close(body: bytes | bytearray | IO[bytes] | None):
+    """
+    Removes the temporary file of the spilled body
+    """
+    if body is not None and not isinstance(body, bytes | bytearray):
+        body.close()
+
+
+def item_write(result: dict, write: Callable[[bytes], Any]):
+    """
+    Writes the result of a single package item as a JSON object.
+    The JSON body of the sub-response is embedded into the envelope as is,
+    without decoding and re-encoding it. The spilled body is copied by chunks
+    """
+    body = result.pop('response', None)
+    is_json = result.pop('is_json', False)
+    result['headers'] = headers_decode(result.get('headers'))
+
+    # the last byte of the head is the closing brace of the object
+    write(json_dumps(result)[:-1])
+    write(b',"response":')
+    try:
+        if not body:
+            write(b'null')
+        elif is_json:
+            for chunk in body_chunks(body):
+                write(chunk)
+        else:
+            # a chunk may end in the middle of a character
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            write(b'"')
+            for chunk in body_chunks(body):
+                write(json_dumps(decoder.decode(chunk))[1:-1])
+            write(json_dumps(decoder.decode(b'', final=True))[1:-1])
+            write(b'"')
+    finally:
+        body_close(body)
+    write(b'}')
+
+
+def item_encode(result: dict) -> bytes:
+    """
+    Encodes the result of a single package item into a JSON object
+    """
+    parts = []
+    item_write(result, parts.append)
+    return b''.join(parts)
+
+
+# the end of the result of a batch item: its array of results and the object
+BATCH_TAIL = b']}'
+
+
+def batch_head_encode(endpoint: str) -> bytes:
+    """
+    Encodes the beginning of the result of a batch item, up to its array of results
+    """
+    return json_dumps({'endpoint': endpoint})[:-1] + b',"results":['
+
+
+def batch_encode(endpoint: str, items: list[bytes]) -> bytes:
+    """
+    Encodes the result of a batch item from the encoded results of its bodies
+    """
+    return b''.join((batch_head_encode(endpoint), b','.join(items), BATCH_TAIL))
+
+
+def envelope_encode(items: list[bytes]) -> bytes:
+    """
+    Joins the encoded package items into a JSON array
+    """
+    return b''.join((b'[', b','.join(items), b']'))
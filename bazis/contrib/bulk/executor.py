@@ -0,0 +1,531 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import dataclasses
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator, Sequence
+from contextlib import aclosing, asynccontextmanager
+from tempfile import TemporaryFile
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from fastapi import FastAPI, Request
+
+from starlette.types import ASGIApp
+
+from . import schemas
+from .auth import BULK_IDENTITY
+from .costs import cost_model, route_key
+from .dispatch import SCOPE_ROUTE, app_bulk_get, route_scope_resolve
+from .encoders import body_close, json_dumps
+from .headers import conditional_apply, header_get, headers_encode, headers_merge
+from .idempotency import PackageIdempotency
+from .metrics import bulk_metrics
+from .results import BulkResults
+from .scheduler import bulk_scheduler
+from .utils import ThreadsPool
+
+
+# status of the package which client has closed the connection
+STATUS_CLIENT_CLOSED = 499
+# status of the item that is not completed within the timeout or the deadline of the package
+STATUS_TIMEOUT = 504
+
+
+class BulkRollbackError(Exception): ...
+
+
+@dataclasses.dataclass(slots=True)
+class BulkItemPrepared:
+    """
+    Package item that is ready to be dispatched: the scope and the body of the sub-request
+    """
+
+    endpoint: str
+    method: str
+    body: bytes
+    headers_item: list[tuple[bytes, bytes]]
+    scope: dict
+    # the position of the sub-request in its batch and the size of the batch
+    body_index: int | None = None
+    batch_size: int | None = None
+
+    @property
+    def is_batch_last(self) -> bool:
+        return self.body_index is not None and self.body_index == self.batch_size - 1
+
+    async def receive(self) -> dict:
+        return {
+            'type': 'http.request',
+            'body': self.body,
+        }
+
+
+def sender_make(result: dict, buffer_size: int | None = None) -> Callable[[dict], Awaitable[None]]:
+    """
+    Builds the ASGI send callable that collects the sub-response into the result of a package item.
+    The chunks of the body are appended to a single buffer until the last one. The body larger
+    than `buffer_size` is streamed to a temporary file instead of the memory
+    """
+
+    async def sender(data: dict):
+        if data['type'] == 'http.response.start':
+            result['status'] = data['status']
+            result['headers'] = data['headers']
+            # determine the content type, the JSON body is embedded into the envelope as is
+            content_type = header_get(data['headers'], b'content-type')
+            result['is_json'] = bool(content_type and b'json' in content_type)
+            result['response'] = bytearray()
+        elif data['type'] == 'http.response.body':
+            body = result.setdefault('response', bytearray())
+            chunk = data.get('body', b'')
+            if (
+                buffer_size is not None
+                and isinstance(body, bytearray)
+                and len(body) + len(chunk) > buffer_size
+            ):
+                spilled = TemporaryFile()
+                spilled.write(body)
+                body = result['response'] = spilled
+            if isinstance(body, bytearray):
+                body += chunk
+            else:
+                body.write(chunk)
+
+    return sender
+
+
+def scope_make(
+    request: Request,
+    app: FastAPI,
+    state: dict,
+    endpoint: str,
+    method: str,
+    headers_item: list[tuple[bytes, bytes]],
+) -> dict:
+    """
+    Builds the scope of a sub-request without the length of its body
+    """
+    url = urlparse(endpoint)
+    return {
+        'app': app,
+        'type': request.scope.get('type'),
+        'asgi': request.scope.get('asgi'),
+        'http_version': request.scope.get('http_version'),
+        'server': request.scope.get('server'),
+        'client': request.scope.get('client'),
+        'scheme': request.scope.get('scheme'),
+        'headers': headers_merge(request.scope['headers'], headers_item),
+        'method': method,
+        'query_string': url.query and url.query.encode(),
+        'path': url.path,
+        'raw_path': url.path,
+        'state': dict(state),
+    }
+
+
+def content_length_header(body: bytes) -> tuple[bytes, bytes]:
+    return b'content-length', str(len(body)).encode('latin-1')
+
+
+def item_prepare(
+    request: Request, app: FastAPI, state: dict, item: schemas.BulkRequestItemSchema
+) -> BulkItemPrepared:
+    """
+    Parses the endpoint of a package item, encodes its body and builds the sub-request scope
+    """
+    method = item.method.upper()
+    body = json_dumps(item.body)
+    headers_item = headers_encode(item.headers)
+
+    scope = scope_make(request, app, state, item.endpoint, method, headers_item)
+    scope['headers'].append(content_length_header(body))
+
+    return BulkItemPrepared(
+        endpoint=item.endpoint,
+        method=method,
+        body=body,
+        headers_item=headers_item,
+        scope=scope,
+    )
+
+
+def batch_prepare(
+    request: Request, app: FastAPI, state: dict, item: schemas.BulkBatchItemSchema
+) -> Iterator[BulkItemPrepared]:
+    """
+    Prepares the sub-requests of a batch item. The scope is built and the route is resolved
+    once for the batch, the sub-requests differ only by the body
+    """
+    method = item.method.upper()
+    headers_item = headers_encode(item.headers)
+
+    template = scope_make(request, app, state, item.endpoint, method, headers_item)
+    if (resolved := route_scope_resolve(app.router, template)) is not None:
+        template[SCOPE_ROUTE] = resolved
+
+    for index, body in enumerate(item.bodies):
+        body = json_dumps(body)
+        yield BulkItemPrepared(
+            endpoint=item.endpoint,
+            method=method,
+            body=body,
+            headers_item=headers_item,
+            scope={
+                **template,
+                'headers': [*template['headers'], content_length_header(body)],
+                'state': dict(state),
+            },
+            body_index=index,
+            batch_size=len(item.bodies),
+        )
+
+
+def items_expand(
+    request: Request, app: FastAPI, state: dict, items: Sequence[schemas.BulkPackageItemSchema]
+) -> Iterator[BulkItemPrepared]:
+    """
+    Yields the prepared sub-requests of the package items, a batch item yields one per body
+    """
+    for item in items:
+        if isinstance(item, schemas.BulkBatchItemSchema):
+            yield from batch_prepare(request, app, state, item)
+        else:
+            yield item_prepare(request, app, state, item)
+
+
+async def items_prepare(
+    request: Request,
+    app: FastAPI,
+    state: dict,
+    items: Sequence[schemas.BulkPackageItemSchema],
+    prefetch: int,
+) -> AsyncIterator[BulkItemPrepared]:
+    """
+    Yields the prepared package items in their order. Up to `prefetch` next items are prepared
+    by a producer task on the event loop while the current item is executed in the worker thread,
+    so the preparation overlaps with the database work. With `prefetch` < 1 the items are
+    prepared one by one
+    """
+    if prefetch < 1:
+        for prepared in items_expand(request, app, state, items):
+            yield prepared
+        return
+
+    queue = asyncio.Queue(maxsize=prefetch)
+
+    async def produce():
+        try:
+            for prepared in items_expand(request, app, state, items):
+                await queue.put(prepared)
+                # let the consumer continue as soon as its item is executed
+                await asyncio.sleep(0)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (prepared := await queue.get()) is not None:
+            if isinstance(prepared, Exception):
+                raise prepared
+            yield prepared
+    finally:
+        producer.cancel()
+
+
+@dataclasses.dataclass(slots=True)
+class BulkPackage:
+    """
+    Package request being executed
+    """
+
+    request: Request
+    app: FastAPI
+    state: dict
+    items: Sequence[schemas.BulkPackageItemSchema]
+    is_atomic: bool
+    idempotency: PackageIdempotency | None = None
+    # set when the client of the package request disconnects
+    disconnected: asyncio.Event | None = None
+    # the event loop time by which the package must be completed
+    deadline: float | None = None
+    # the maximum duration of an item, seconds
+    item_timeout: float | None = None
+    # the key of the tenant the sub-requests are scheduled for
+    tenant: str = ''
+    # the execution lane of the package, the lane of the package slot
+    lane: str = ''
+    # the statements of every item are reported with its result
+    is_diagnosed: bool = False
+
+    def timeout_get(self) -> float | None:
+        """
+        Returns the time available to the next item, seconds
+        """
+        timeouts = []
+        if self.item_timeout is not None:
+            timeouts.append(self.item_timeout)
+        if self.deadline is not None:
+            timeouts.append(self.deadline - asyncio.get_running_loop().time())
+        return min(timeouts) if timeouts else None
+
+
+def item_timeout(endpoint: str, status: int = STATUS_TIMEOUT) -> dict:
+    return {'endpoint': endpoint, 'status': status, 'headers': []}
+
+
+def items_timeout_fill(
+    results: BulkResults,
+    items: Sequence[schemas.BulkPackageItemSchema],
+    executed: int,
+    status: int = STATUS_TIMEOUT,
+):
+    """
+    Appends the results of the items that are not executed because of the timeout
+    (or of the other reason given by the status).
+    The batch being executed is completed with the results of its remaining bodies
+    """
+    if results.batch_count is not None:
+        item = items[executed]
+        for _ in range(len(item.bodies) - results.batch_count):
+            results.append_item(item_timeout(item.endpoint, status))
+        results.batch_end()
+        executed += 1
+
+    for item in items[executed:]:
+        if isinstance(item, schemas.BulkBatchItemSchema):
+            results.batch_begin(item.endpoint)
+            for _ in item.bodies:
+                results.append_item(item_timeout(item.endpoint, status))
+            results.batch_end()
+        else:
+            results.append_item(item_timeout(item.endpoint, status))
+
+
+async def item_dispatch(
+    app_bulk: ASGIApp,
+    prepared: BulkItemPrepared,
+    result: dict,
+    thread: ThreadsPool,
+    timeout: float | None,
+) -> bool:
+    """
+    Dispatches the sub-request. Returns False if it is not completed within the timeout:
+    then its running query is cancelled on the database server, since the sync code in the thread
+    cannot be interrupted and the wait for it is shielded from the cancellation
+    """
+    sender = sender_make(result, settings.BAZIS_BULK_ITEM_BUFFER_SIZE)
+    dispatch = app_bulk(prepared.scope, prepared.receive, sender)
+    if timeout is None:
+        await dispatch
+        return True
+
+    task = asyncio.ensure_future(dispatch)
+    await asyncio.wait((task,), timeout=timeout)
+    if task.done():
+        task.result()
+        return True
+
+    await thread.cancel()
+    task.cancel()
+    try:
+        await asyncio.wait((task,))
+    finally:
+        await thread.cancel_reset()
+    # the error of the cancelled sub-request is expected
+    if not task.cancelled():
+        task.exception()
+    return False
+
+
+@asynccontextmanager
+async def disconnect_watch(request: Request) -> AsyncIterator[asyncio.Event]:
+    """
+    Watches the receive channel of the package request. The body is already read,
+    so the next message is the disconnect of the client.
+    A nested package, sent as a sub-request of another package, is not watched: its receive
+    returns the body of the sub-request again and again, the outer package watches the client
+    """
+    disconnected = asyncio.Event()
+    if BULK_IDENTITY in request.scope.get('state', {}):
+        yield disconnected
+        return
+
+    async def watch():
+        while (await request.receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield disconnected
+    finally:
+        watcher.cancel()
+
+
+async def items_run(package: BulkPackage, thread: ThreadsPool, results: BulkResults) -> int:
+    """
+    Executes the package items one after another within the entered thread behavior
+    and appends their results. Returns the status of the package.
+    When the client disconnects, the remaining items are not executed. The items that are
+    not completed within the timeout or the deadline have the 504 status: the atomic package
+    is stopped, the non-atomic package continues while the deadline allows
+    """
+    request, app = package.request, package.app
+    app_bulk = app_bulk_get(app)
+
+    status_code = 200
+    is_timed_out = False
+    # the number of the package items whose results are complete
+    executed = 0
+
+    def item_complete(prepared: BulkItemPrepared):
+        nonlocal executed
+        if prepared.body_index is None or prepared.is_batch_last:
+            results.batch_end()
+            executed += 1
+
+    async with aclosing(
+        items_prepare(request, app, package.state, package.items, settings.BAZIS_BULK_PREFETCH)
+    ) as items_prepared:
+        async for prepared in items_prepared:
+            # nobody will see the results of the remaining items
+            if package.disconnected and package.disconnected.is_set():
+                status_code = STATUS_CLIENT_CLOSED
+                bulk_metrics.inc('packages_aborted')
+                bulk_metrics.inc('items_aborted', len(package.items) - executed)
+                results.batch_end()
+                break
+
+            timeout = package.timeout_get()
+            if timeout is not None and timeout <= 0:
+                # the deadline of the package is passed
+                is_timed_out = True
+                break
+
+            # the results of a batch are collected into its compact array
+            if prepared.body_index == 0:
+                results.batch_begin(prepared.endpoint)
+
+            # build the response
+            result = {
+                'endpoint': prepared.endpoint,
+            }
+
+            await thread.item_enter(prepared.method)
+            if thread.queries is not None:
+                thread.queries.clear()
+
+            # the slots are shared fairly with the packages of the other tenants,
+            # the wait for a slot is counted against the deadline
+            async with bulk_scheduler.slot(package.tenant):
+                time_start = time.monotonic()
+                # sync routes are executed in the dedicated thread (since we are in the context of this thread),
+                # async routes are awaited on the event loop
+                is_completed = await item_dispatch(
+                    app_bulk, prepared, result, thread, package.timeout_get()
+                )
+            await thread.item_exit(prepared.method)
+
+            if not is_completed:
+                body_close(result.get('response'))
+                bulk_metrics.inc('items_timed_out')
+                results.append_item(item_timeout(prepared.endpoint))
+                item_complete(prepared)
+                # the transaction is broken by the cancelled query
+                if package.is_atomic:
+                    is_timed_out = True
+                    break
+                continue
+
+            # the durations of the routes are learned by the cost model
+            cost_model.observe(
+                route_key(prepared.method, prepared.scope.get('route'), prepared.scope['path']),
+                time.monotonic() - time_start,
+            )
+
+            # if an exception occurred inside the dedicated thread - the transaction needs to be restarted
+            await thread.check()
+
+            # conditional requests: an unchanged resource is returned without a body
+            if prepared.method == 'GET':
+                conditional_apply(result, prepared.headers_item)
+
+            if thread.queries is not None:
+                result['diagnostics'] = thread.queries.report(
+                    settings.BAZIS_BULK_DIAGNOSTICS_REPEATS
+                )
+
+            # for any incorrect response of a package item - we make the overall package status non-working
+            if package.is_atomic and result['status'] >= 400:
+                status_code = 400
+            results.append_item(result)
+            item_complete(prepared)
+
+    # the remaining items are not executed because of the timeout
+    if is_timed_out:
+        bulk_metrics.inc('packages_timed_out')
+        items_timeout_fill(results, package.items, executed)
+        if package.is_atomic:
+            status_code = STATUS_TIMEOUT
+
+    return status_code
+
+
+async def items_execute(
+    package: BulkPackage, thread_behavior: ThreadsPool
+) -> tuple[BulkResults | bytes, int]:
+    """
+    Executes the package within the thread behavior.
+    Returns the results (or the stored envelope) and the status of the package.
+    The package with the idempotency key, that is already committed, is not executed again:
+    its stored result is returned. The failed atomic package is rolled back.
+    The results are spooled as they are encoded, the large ones are spilled to a temporary file
+    """
+    idempotency = package.idempotency
+
+    # collect the encoded responses
+    results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+    status_code = 200
+
+    try:
+        async with thread_behavior as thread:
+            if idempotency and (stored := await idempotency.claim(thread)):
+                results.close()
+                return stored
+
+            status_code = await items_run(package, thread, results)
+
+            # if the status is non-working - roll back the transaction
+            if package.is_atomic and status_code >= 400:
+                raise BulkRollbackError
+
+            # the result is committed together with the changes of the package,
+            # the result spilled to the file is not read into the memory
+            if idempotency:
+                content = None if results.is_spilled else results.getvalue()
+                await idempotency.store(thread, content, status_code)
+                return results, status_code
+
+    except BulkRollbackError:
+        pass
+    except BaseException:
+        results.close()
+        raise
+
+    # the envelope is built directly as bytes, bypassing jsonable_encoder and response_model validation
+    return results, status_code
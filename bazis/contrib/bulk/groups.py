@@ -0,0 +1,168 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import dataclasses
+import logging
+from collections import deque
+from collections.abc import Sequence
+
+from django.conf import settings
+
+from . import schemas
+from .auth import BULK_IDENTITY
+from .executor import BulkPackage, items_execute, items_timeout_fill
+from .lanes import bulk_lanes
+from .metrics import bulk_metrics
+from .preflight import items_preflight, preflight_is_enabled
+from .results import BulkResults
+from .retry import is_retryable, retry_budget, retry_delay
+from .utils import ThreadDedicated
+
+
+LOG = logging.getLogger(__name__)
+
+GROUP_COMMITTED = 'committed'
+GROUP_ROLLED_BACK = 'rolled_back'
+
+# the status of the items of a group that failed with a serialization failure or a deadlock
+STATUS_CONFLICT = 409
+STATUS_ERROR = 500
+
+
+def package_is_grouped(items: Sequence[schemas.BulkPackageItemSchema], is_atomic: bool) -> bool:
+    """
+    Whether the atomic package is split into the groups of the items
+    """
+    return is_atomic and any(item.group is not None for item in items)
+
+
+def groups_split(items: Sequence[schemas.BulkPackageItemSchema]) -> dict[str | None, list]:
+    """
+    Splits the items into the groups, keeping their order. The items without the group
+    make a group of their own
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(item.group, []).append(item)
+    return groups
+
+
+async def group_execute(
+    package: BulkPackage, options: schemas.BulkTransactionSchema, retries_max: int
+) -> tuple[BulkResults, int]:
+    """
+    Executes the group in its own transaction and the dedicated thread.
+    The group with invalid items is rejected by the pre-flight validation alone.
+    The group rolled back by a serialization failure or a deadlock is replayed alone
+    """
+    if preflight_is_enabled(package.state.get(BULK_IDENTITY)):
+        rejected = await items_preflight(package.request, package.app, package.state, package.items)
+        if rejected is not None:
+            results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+            results.extend(rejected)
+            return results, 400
+
+    attempt = 0
+    while True:
+        try:
+            thread_behavior = ThreadDedicated(
+                is_lazy=True, options=options, is_diagnosed=package.is_diagnosed
+            )
+            return await items_execute(package, thread_behavior)
+        except Exception as e:
+            if not is_retryable(e) or attempt >= retries_max or not retry_budget.acquire():
+                raise
+            attempt += 1
+            bulk_metrics.inc('retries')
+            await asyncio.sleep(retry_delay(attempt))
+
+
+async def groups_execute(
+    package: BulkPackage, options: schemas.BulkTransactionSchema, retries_max: int
+) -> tuple[BulkResults, int, dict[str, str]]:
+    """
+    Executes the groups of the package concurrently, up to `BAZIS_BULK_GROUPS_CONCURRENCY` at once.
+    Every group is committed or rolled back alone. Returns the results in the order of the items,
+    the status of the package and the outcomes of the groups.
+    A group holds a dedicated thread and a database connection, like a whole package: the first
+    group runs in the slot of the package lane, every next concurrent group takes a free slot
+    of the lane, and without free slots the groups are executed one after another
+    """
+    groups = groups_split(package.items)
+    pending = deque(groups.items())
+    outcomes = {}
+
+    async def group_run(items: list) -> tuple[BulkResults, int]:
+        group = dataclasses.replace(package, items=items, idempotency=None)
+        try:
+            return await group_execute(group, options, retries_max)
+        except Exception as e:
+            # the other groups are not affected by the failed one
+            LOG.exception('The group of the bulk package failed')
+            status_code = STATUS_CONFLICT if is_retryable(e) else STATUS_ERROR
+            results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+            items_timeout_fill(results, items, 0, status_code)
+            return results, status_code
+
+    async def groups_run():
+        while pending:
+            key, items = pending.popleft()
+            outcomes[key] = await group_run(items)
+
+    async def groups_run_extra():
+        if not pending or not bulk_lanes.slot_try(package.lane):
+            return
+        try:
+            await groups_run()
+        finally:
+            bulk_lanes.slot_release(package.lane)
+
+    results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            task_group.create_task(groups_run())
+            for _ in range(min(settings.BAZIS_BULK_GROUPS_CONCURRENCY, len(groups)) - 1):
+                task_group.create_task(groups_run_extra())
+
+        # the results of the groups are merged in the order of the items
+        indexes = dict.fromkeys(groups, 0)
+        for item in package.items:
+            group_results = outcomes[item.group][0]
+            if indexes[item.group] < len(group_results):
+                results.append(group_results.read(indexes[item.group]))
+            indexes[item.group] += 1
+    except BaseException:
+        results.close()
+        raise
+    finally:
+        for group_results, _ in outcomes.values():
+            group_results.close()
+
+    # the items without the group are reported under the empty key
+    statuses = {
+        '' if key is None else key: GROUP_COMMITTED if status_code < 400 else GROUP_ROLLED_BACK
+        for key, (_, status_code) in outcomes.items()
+    }
+    failed = sum(status == GROUP_ROLLED_BACK for status in statuses.values())
+    bulk_metrics.inc('groups', len(statuses))
+    bulk_metrics.inc('groups_rolled_back', failed)
+
+    if not failed:
+        status_code = 200
+    elif failed < len(statuses):
+        status_code = 207
+    else:
+        status_code = 400
+    return results, status_code, statuses
@@ -0,0 +1,142 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import Iterable
+from email.utils import parsedate_to_datetime
+from hashlib import blake2b
+from typing import Any
+
+from .encoders import body_chunks, body_close
+
+
+# headers of the package request that describe the package body itself and must not be passed
+# to the sub-requests
+HEADERS_PACKAGE = frozenset((b'content-length', b'transfer-encoding', b'expect'))
+
+# the identity of all the package items is the identity of the package request,
+# so the item headers cannot replace it
+HEADERS_IDENTITY = frozenset((b'authorization', b'cookie'))
+
+
+def headers_encode(headers: list[tuple[str, Any]] | None) -> list[tuple[bytes, bytes]]:
+    """
+    Converts the headers of a package item into ASGI headers. Identity headers are skipped
+    """
+    result = []
+    for name, value in headers or ():
+        name = str(name).strip().lower().encode('latin-1')
+        if name not in HEADERS_IDENTITY:
+            result.append((name, str(value).encode('utf-8')))
+    return result
+
+
+def headers_merge(
+    headers: list[tuple[bytes, bytes]],
+    headers_item: list[tuple[bytes, bytes]],
+) -> list[tuple[bytes, bytes]]:
+    """
+    Builds the headers of a sub-request: the headers of the package request are overridden
+    by the headers of the package item with the same name
+    """
+    names_item = {name for name, _ in headers_item}
+    result = [
+        (name, value)
+        for name, value in headers
+        if name not in names_item and name not in HEADERS_PACKAGE
+    ]
+    result.extend((name, value) for name, value in headers_item if name not in HEADERS_PACKAGE)
+    return result
+
+
+def header_get(headers: list[tuple[bytes, bytes]] | None, name: bytes) -> bytes | None:
+    """
+    Returns the value of the first header with the given name
+    """
+    for key, value in headers or ():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def etag_calc(chunks: Iterable[bytes]) -> bytes:
+    """
+    Calculates a strong ETag from the content of a response body
+    """
+    digest = blake2b(digest_size=16)
+    for chunk in chunks:
+        digest.update(chunk)
+    return b'"' + digest.hexdigest().encode('latin-1') + b'"'
+
+
+def etag_match(if_none_match: bytes, etag: bytes) -> bool:
+    """
+    Weak comparison of the ETag with the If-None-Match header value
+    """
+    if if_none_match.strip() == b'*':
+        return True
+    etag = etag.removeprefix(b'W/')
+    return any(tag.strip().removeprefix(b'W/') == etag for tag in if_none_match.split(b','))
+
+
+def is_modified_since(if_modified_since: bytes, last_modified: bytes) -> bool:
+    """
+    Compares the Last-Modified header of a response with the If-Modified-Since header value.
+    Unparseable dates are treated as modified
+    """
+    try:
+        return parsedate_to_datetime(last_modified.decode('latin-1')) > parsedate_to_datetime(
+            if_modified_since.decode('latin-1')
+        )
+    except (TypeError, ValueError):
+        return True
+
+
+def conditional_apply(result: dict, headers_item: list[tuple[bytes, bytes]]) -> None:
+    """
+    Evaluates the conditional headers of a package item against a successful GET sub-response.
+    The ETag of the sub-response is calculated from its body if the item is sent with
+    If-None-Match and the route did not set it, the other items cost nothing.
+    An unchanged resource is returned with the 304 status and without a body
+    """
+    if result.get('status') != 200:
+        return
+
+    if_none_match = header_get(headers_item, b'if-none-match')
+    if_modified_since = header_get(headers_item, b'if-modified-since')
+    if if_none_match is None and if_modified_since is None:
+        return
+
+    headers = list(result.get('headers') or ())
+    result['headers'] = headers
+
+    if if_none_match is not None:
+        etag = header_get(headers, b'etag')
+        if etag is None:
+            etag = etag_calc(body_chunks(result.get('response')))
+            headers.append((b'etag', etag))
+        is_modified = not etag_match(if_none_match, etag)
+    elif (last_modified := header_get(headers, b'last-modified')) is not None:
+        is_modified = is_modified_since(if_modified_since, last_modified)
+    else:
+        is_modified = True
+
+    if not is_modified:
+        result['status'] = 304
+        body_close(result.get('response'))
+        result['response'] = None
+        result['headers'] = [
+            (name, value)
+            for name, value in headers
+            if name not in (b'content-length', b'content-type')
+        ]
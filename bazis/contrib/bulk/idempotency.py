@@ -0,0 +1,155 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import timedelta
+from hashlib import blake2b
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, connections
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from fastapi import HTTPException, Request
+
+from .auth import BulkIdentity, identity_owner
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_LENGTH = 255
+
+
+class PackageIdempotency:
+    """
+    Idempotency of an atomic package. In the transaction of the package, the key is locked with
+    a transaction-level advisory lock, so a concurrent duplicate waits for the in-flight package
+    (or is rejected, if waiting is disabled) and then gets its stored result.
+    The result is stored in the same transaction as the changes of the package
+    """
+
+    def __init__(self, key: str, owner: str, fingerprint: str):
+        self.key = key
+        self.owner = owner
+        self.fingerprint = fingerprint
+        self.is_replayed = False
+
+    @property
+    def lock_id(self) -> int:
+        digest = blake2b(f'{self.owner}:{self.key}'.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    def _lock(self, using: str):
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            if settings.BAZIS_BULK_IDEMPOTENCY_WAIT:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [self.lock_id])
+                return
+            cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [self.lock_id])
+            if not cursor.fetchone()[0]:
+                raise HTTPException(
+                    status_code=409,
+                    detail=_('A package with the same idempotency key is in progress'),
+                )
+
+    def _claim(self, using: str) -> tuple[bytes, int] | None:
+        from .models import BulkIdempotency
+
+        self._lock(using)
+
+        entry = BulkIdempotency.objects.using(using).filter(owner=self.owner, key=self.key).first()
+        if entry is None:
+            return None
+        if entry.dt_expires <= timezone.now():
+            entry.delete()
+            return None
+        if entry.fingerprint != self.fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail=_('The idempotency key is already used with a different package'),
+            )
+        if not (content := bytes(entry.content)):
+            raise HTTPException(
+                status_code=409,
+                detail=_('The package with the same idempotency key is already executed'),
+            )
+        return content, entry.status
+
+    def _store(self, using: str, content: bytes | None, status_code: int):
+        from .models import BulkIdempotency
+
+        try:
+            BulkIdempotency.objects.using(using).create(
+                owner=self.owner,
+                key=self.key,
+                fingerprint=self.fingerprint,
+                status=status_code,
+                content=content or b'',
+                dt_expires=timezone.now() + timedelta(seconds=settings.BAZIS_BULK_IDEMPOTENCY_TTL),
+            )
+        except IntegrityError:
+            # without the advisory lock, the concurrent duplicate is committed first
+            raise HTTPException(
+                status_code=409,
+                detail=_('A package with the same idempotency key is in progress'),
+            ) from None
+
+    async def claim(self, thread) -> tuple[bytes, int] | None:
+        """
+        Returns the stored result of the package with the same key, if it was committed
+        """
+        stored = await thread.run(self._claim, thread.using)
+        self.is_replayed = stored is not None
+        return stored
+
+    async def store(self, thread, content: bytes | None, status_code: int):
+        """
+        Stores the result of the package. The result that is too large to be kept in memory
+        is not stored, the duplicate of such a package is rejected instead of replayed
+        """
+        await thread.run(self._store, thread.using, content, status_code)
+
+
+async def idempotency_get(
+    request: Request, identity: BulkIdentity | None
+) -> PackageIdempotency | None:
+    """
+    Returns the idempotency of the package request, if the key is passed.
+    The keys are separated by the users, the anonymous requests cannot use them: the clients
+    behind the same proxy would replay the results of each other.
+    The fingerprint binds the key to the content of the package
+    """
+    if not (key := request.headers.get(IDEMPOTENCY_HEADER)):
+        return None
+
+    if not apps.is_installed('bazis.contrib.bulk'):
+        raise HTTPException(
+            status_code=400,
+            detail=_('Idempotency keys require bazis.contrib.bulk in INSTALLED_APPS'),
+        )
+    if len(key) > IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=_('The idempotency key is too long'))
+
+    if not (owner := identity_owner(identity)):
+        raise HTTPException(
+            status_code=401, detail=_('Idempotency keys require an authenticated user')
+        )
+
+    fingerprint = blake2b(digest_size=32)
+    fingerprint.update(request.url.query.encode())
+    fingerprint.update(b'\0')
+    fingerprint.update(await request.body())
+
+    return PackageIdempotency(key, owner, fingerprint.hexdigest())
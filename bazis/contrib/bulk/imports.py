@@ -0,0 +1,266 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import codecs
+import csv
+from collections.abc import AsyncIterator
+from contextlib import AsyncExitStack
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from fastapi import FastAPI, HTTPException, Request
+
+from . import schemas
+from .dispatch import exception_dispatch
+from .encoders import json_loads
+from .executor import BulkPackage, BulkRollbackError, items_run, scope_make, sender_make
+from .results import BulkResults
+from .utils import ThreadDedicated
+
+
+IMPORT_FORMATS = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+
+def import_format_get(content_type: str | None) -> str | None:
+    """
+    Returns the format of the import file by the content type of the request
+    """
+    return IMPORT_FORMATS.get((content_type or '').split(';')[0].strip().lower())
+
+
+def mapping_parse(mapping: str | None) -> dict[str, str] | None:
+    """
+    Parses the column-to-attribute mapping: a JSON object of strings
+    """
+    if mapping is None:
+        return None
+    try:
+        value = json_loads(mapping)
+    except ValueError:
+        value = None
+    if not isinstance(value, dict) or not all(
+        isinstance(it, str) for pair in value.items() for it in pair
+    ):
+        raise HTTPException(
+            status_code=400,
+            detail=_('The mapping must be a JSON object of the column and attribute names'),
+        )
+    return value
+
+
+async def lines_read(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Yields the lines of the streamed body without reading it into the memory
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    async for chunk in stream:
+        *lines, tail = (tail + decoder.decode(chunk)).split('\n')
+        for line in lines:
+            yield line + '\n'
+    if tail := tail + decoder.decode(b'', final=True):
+        yield tail
+
+
+async def rows_ndjson(stream: AsyncIterator[bytes]) -> AsyncIterator[dict]:
+    """
+    Yields the objects of the NDJSON body, the empty lines are skipped
+    """
+    number = 0
+    async for line in lines_read(stream):
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = json_loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            raise HTTPException(
+                status_code=400,
+                detail=_('Line %s of the file is not a JSON object') % number,
+            )
+        yield row
+
+
+async def rows_csv(stream: AsyncIterator[bytes], delimiter: str = ',') -> AsyncIterator[dict]:
+    """
+    Yields the rows of the CSV body by the columns of its first row.
+    A quoted value may contain the line breaks, so a record can take several lines
+    """
+    columns = None
+    record = ''
+    async for line in lines_read(stream):
+        record += line
+        # the record is complete when its quotes are balanced
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record], delimiter=delimiter), [])
+        record = ''
+        if not values:
+            continue
+        if columns is None:
+            columns = values
+            continue
+        yield dict(zip(columns, values, strict=False))
+
+    if record:
+        raise HTTPException(status_code=400, detail=_('The last record of the file is not closed'))
+
+
+def row_item(
+    row: dict, endpoint: str, resource_type: str, mapping: dict[str, str] | None
+) -> schemas.BulkRequestItemSchema:
+    """
+    Builds the package item that creates the resource from the row of the file.
+    Without the mapping, the columns are the attributes of the resource
+    """
+    if mapping is None:
+        attributes = row
+    else:
+        attributes = {
+            attribute: row[column] for column, attribute in mapping.items() if column in row
+        }
+    return schemas.BulkRequestItemSchema(
+        endpoint=endpoint,
+        method='POST',
+        body={
+            'data': {
+                'type': resource_type,
+                'bs:action': 'add',
+                'attributes': attributes,
+            },
+        },
+    )
+
+
+async def batches_read(
+    rows: AsyncIterator[dict],
+    endpoint: str,
+    resource_type: str,
+    mapping: dict[str, str] | None,
+    batch_size: int,
+) -> AsyncIterator[list[schemas.BulkRequestItemSchema]]:
+    """
+    Yields the package items built from the rows by batches of `batch_size`.
+    The rows before a malformed one are yielded before its error is raised
+    """
+    batch = []
+    try:
+        async for row in rows:
+            batch.append(row_item(row, endpoint, resource_type, mapping))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except HTTPException:
+        if batch:
+            yield batch
+        raise
+    if batch:
+        yield batch
+
+
+async def row_error(
+    request: Request, app: FastAPI, state: dict, endpoint: str, error: HTTPException
+) -> dict:
+    """
+    Renders the error that stopped the import, such as of the malformed row, as the result
+    of the row
+    """
+    result = {'endpoint': endpoint}
+    scope = scope_make(request, app, state, endpoint, 'POST', [])
+    await exception_dispatch(app, scope, error, sender_make(result))
+    return result
+
+
+async def batches_execute(
+    request: Request,
+    app: FastAPI,
+    state: dict,
+    batches: AsyncIterator[list[schemas.BulkRequestItemSchema]],
+    options: schemas.BulkTransactionSchema,
+    is_atomic: bool,
+    tenant: str = '',
+    endpoint: str = '',
+) -> tuple[BulkResults, int, int]:
+    """
+    Executes the batches of the import as they are read. Returns the results,
+    the number of the batches and the number of the failed batches.
+    The atomic import is executed in a single transaction and is stopped by the first failed batch,
+    the rest of the file is not read. Every batch of the non-atomic import is committed in its own
+    transaction, the failed batch is rolled back alone. A malformed row (or the cost budget
+    exhausted by the batch) stops the non-atomic import: its error is the result of the row
+    and counted as a failed batch, the batches before it stay committed
+    """
+    results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+    batches_count = batches_failed = 0
+
+    try:
+        async with AsyncExitStack() as stack:
+            thread = None
+            if is_atomic:
+                thread = await stack.enter_async_context(
+                    ThreadDedicated(is_lazy=True, options=options)
+                )
+
+            while True:
+                try:
+                    items = await anext(batches)
+                except StopAsyncIteration:
+                    break
+                except HTTPException as e:
+                    if is_atomic:
+                        raise
+                    batches_count += 1
+                    batches_failed += 1
+                    results.append_item(await row_error(request, app, state, endpoint, e))
+                    break
+
+                batches_count += 1
+                package = BulkPackage(
+                    request=request,
+                    app=app,
+                    state=state,
+                    items=items,
+                    is_atomic=True,
+                    tenant=tenant,
+                )
+                if is_atomic:
+                    status_code = await items_run(package, thread, results)
+                else:
+                    try:
+                        async with ThreadDedicated(is_lazy=True, options=options) as batch_thread:
+                            status_code = await items_run(package, batch_thread, results)
+                            if status_code >= 400:
+                                raise BulkRollbackError
+                    except BulkRollbackError:
+                        pass
+
+                if status_code >= 400:
+                    batches_failed += 1
+                    if is_atomic:
+                        raise BulkRollbackError
+
+    except BulkRollbackError:
+        pass
+    except BaseException:
+        results.close()
+        raise
+
+    return results, batches_count, batches_failed
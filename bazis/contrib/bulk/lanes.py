@@ -0,0 +1,128 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager, suppress
+
+from django.conf import settings
+
+from . import schemas
+from .metrics import bulk_metrics
+
+
+LANE_INTERACTIVE = 'interactive'
+LANE_BATCH = 'batch'
+
+
+def lane_select(items: Sequence[schemas.BulkPackageItemSchema], lane: str | None = None) -> str:
+    """
+    Returns the lane of the package by the number of the sub-requests, the bodies of a batch item
+    are counted separately. The requested lane may only move a small package to the batch lane,
+    so a large package cannot take the capacity reserved for the interactive ones
+    """
+    if lane == LANE_BATCH:
+        return LANE_BATCH
+    count = sum(
+        len(item.bodies) if isinstance(item, schemas.BulkBatchItemSchema) else 1 for item in items
+    )
+    return LANE_INTERACTIVE if count <= settings.BAZIS_BULK_LANE_INTERACTIVE_ITEMS else LANE_BATCH
+
+
+class BulkLanes:
+    """
+    Execution lanes of the packages. A lane executes at most the number of the packages set by
+    `BAZIS_BULK_LANES`, the next ones wait in its queue. An executed package occupies one worker
+    thread and one database connection at a time, so the lane caps both, and the large packages
+    cannot take the capacity reserved for the small interactive ones
+    """
+
+    def __init__(self):
+        self.busy = defaultdict(int)
+        self.waiters = defaultdict(deque)
+
+    def _release(self, lane: str):
+        waiters = self.waiters[lane]
+        while waiters:
+            future = waiters.popleft()
+            # the slot is handed over to the waiter, unless it was cancelled
+            if not future.done():
+                future.set_result(None)
+                return
+        self.busy[lane] -= 1
+
+    async def _acquire(self, lane: str, size: int):
+        waiters = self.waiters[lane]
+        if self.busy[lane] < size and not waiters:
+            self.busy[lane] += 1
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiters.append(future)
+        time_start = loop.time()
+        bulk_metrics.inc(f'lane_queued:{lane}')
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(lane)
+            else:
+                with suppress(ValueError):
+                    waiters.remove(future)
+            raise
+        bulk_metrics.observe(f'lane_wait:{lane}', loop.time() - time_start)
+
+    @asynccontextmanager
+    async def slot(self, lane: str) -> AsyncIterator[None]:
+        """
+        Holds a slot of the lane while the package is executed
+        """
+        bulk_metrics.inc(f'packages_lane:{lane}')
+        if (size := settings.BAZIS_BULK_LANES.get(lane)) is None:
+            yield
+            return
+
+        await self._acquire(lane, size)
+        try:
+            yield
+        finally:
+            self._release(lane)
+
+    def slot_try(self, lane: str) -> bool:
+        """
+        Takes a free slot of the lane without waiting, for the additional work of a package
+        that already holds a slot. Returns False if the lane has no free slot
+        """
+        if (size := settings.BAZIS_BULK_LANES.get(lane)) is None:
+            return True
+        if self.busy[lane] < size and not self.waiters[lane]:
+            self.busy[lane] += 1
+            return True
+        return False
+
+    def slot_release(self, lane: str):
+        """
+        Releases the slot taken by `slot_try`
+        """
+        if settings.BAZIS_BULK_LANES.get(lane) is not None:
+            self._release(lane)
+
+    def reset(self):
+        self.busy.clear()
+        self.waiters.clear()
+
+
+bulk_lanes = BulkLanes()
@@ -0,0 +1,30 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from bazis.contrib.bulk.models import BulkIdempotency
+
+
+class Command(BaseCommand):
+    """
+    Deletes the expired results of the packages with the idempotency keys
+    """
+
+    help = 'Deletes the expired results of the packages with the idempotency keys'
+
+    def handle(self, *args, **options):
+        count, _ = BulkIdempotency.objects.filter(dt_expires__lt=timezone.now()).delete()
+        self.stdout.write(f'Deleted: {count}')
@@ -0,0 +1,62 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import defaultdict
+from threading import Lock
+
+
+class BulkMetrics:
+    """
+    In-process counters of the bulk requests. The snapshot can be exported
+    to the monitoring system of the project
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = defaultdict(float)
+
+    def inc(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name: str, value: float):
+        """
+        Registers a value of the distribution: its count, sum and maximum
+        """
+        with self.lock:
+            self.counters[f'{name}_count'] += 1
+            self.counters[f'{name}_sum'] += value
+            self.counters[f'{name}_max'] = max(self.counters[f'{name}_max'], value)
+
+    def merge(self, counters: dict[str, float]):
+        """
+        Adds the counters of another process, such as a worker process of the shards
+        """
+        with self.lock:
+            for name, value in counters.items():
+                if name.endswith('_max'):
+                    self.counters[name] = max(self.counters[name], value)
+                else:
+                    self.counters[name] += value
+
+    def snapshot(self) -> dict[str, float]:
+        with self.lock:
+            return dict(self.counters)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+
+
+bulk_metrics = BulkMetrics()
@@ -0,0 +1,45 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Generated by Django 6.0.1 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkIdempotency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(blank=True, max_length=255, verbose_name='Owner')),
+                ('key', models.CharField(max_length=255, verbose_name='Idempotency key')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Request fingerprint')),
+                ('status', models.PositiveSmallIntegerField(verbose_name='Response status')),
+                ('content', models.BinaryField(verbose_name='Response content')),
+                ('dt_created', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('dt_expires', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+            ],
+            options={
+                'verbose_name': 'Bulk idempotency key',
+                'verbose_name_plural': 'Bulk idempotency keys',
+                'constraints': [models.UniqueConstraint(fields=('owner', 'key'), name='bulk_idempotency_owner_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class BulkIdempotency(models.Model):
+    """
+    Result of a package executed with an idempotency key. The row is written in the transaction
+    of the package, so it exists only if the changes of the package are committed
+    """
+
+    owner = models.CharField(_('Owner'), max_length=255, blank=True)
+    key = models.CharField(_('Idempotency key'), max_length=255)
+    fingerprint = models.CharField(_('Request fingerprint'), max_length=64)
+    status = models.PositiveSmallIntegerField(_('Response status'))
+    content = models.BinaryField(_('Response content'))
+    dt_created = models.DateTimeField(_('Created at'), auto_now_add=True)
+    dt_expires = models.DateTimeField(_('Expires at'), db_index=True)
+
+    class Meta:
+        verbose_name = _('Bulk idempotency key')
+        verbose_name_plural = _('Bulk idempotency keys')
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'key'], name='bulk_idempotency_owner_key'),
+        ]
+
+    def __str__(self):
+        return self.key
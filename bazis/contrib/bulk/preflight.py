@@ -0,0 +1,189 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import Sequence
+from urllib.parse import urlparse
+
+from django.conf import settings
+
+from fastapi import FastAPI, Request
+from fastapi.dependencies.utils import (
+    _should_embed_body_fields,
+    get_flat_dependant,
+    request_body_to_args,
+)
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+
+from starlette.exceptions import HTTPException
+from starlette.routing import BaseRoute, Match, Router
+
+from . import schemas
+from .auth import BulkIdentity
+from .dispatch import exception_dispatch
+from .encoders import batch_encode, item_encode
+from .executor import item_prepare, sender_make
+
+
+# status of the valid items of a package that is rejected by the pre-flight validation
+STATUS_DEPENDENCY_FAILED = 424
+
+
+def preflight_is_enabled(identity: BulkIdentity | None) -> bool:
+    """
+    Whether the items are validated before they are executed. The items of a request without
+    a valid token are not validated: their routes answer with the authentication error,
+    not with the validation details
+    """
+    return settings.BAZIS_BULK_PREFLIGHT and (identity is None or identity.error is None)
+
+
+def route_body_fields(route: APIRoute) -> tuple[list, bool]:
+    """
+    Returns the body fields of the route and its dependencies and whether they are embedded.
+    The flat dependant is calculated by the route itself when it is created,
+    the versions of FastAPI that do not keep it on the route calculate it the same way
+    """
+    flat_dependant = getattr(route, '_flat_dependant', None)
+    if flat_dependant is None:
+        flat_dependant = get_flat_dependant(route.dependant)
+    embed_body_fields = getattr(route, '_embed_body_fields', None)
+    if embed_body_fields is None:
+        embed_body_fields = _should_embed_body_fields(flat_dependant.body_params)
+    return flat_dependant.body_params, embed_body_fields
+
+
+def route_resolve(router: Router, scope: dict) -> tuple[BaseRoute | None, Match]:
+    """
+    Finds the route of the sub-request the same way as the router does.
+    The partial match means that the path is found but the method is not allowed
+    """
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route, match
+        if match == Match.PARTIAL and partial is None:
+            partial = route
+    if partial is not None:
+        return partial, Match.PARTIAL
+    return None, Match.NONE
+
+
+def endpoint_preflight(
+    app: FastAPI, endpoint: str, method: str
+) -> tuple[BaseRoute | None, Exception | None]:
+    """
+    Resolves the route of a package item. Returns the route whose body is validated
+    and the error the router would raise
+    """
+    router = app.router
+    path = urlparse(endpoint).path
+    scope = {'type': 'http', 'path': path, 'method': method.upper()}
+
+    route, match = route_resolve(router, scope)
+
+    if match == Match.NONE:
+        # the router redirects to the path with or without the trailing slash
+        if router.redirect_slashes and path != '/':
+            path_redirect = path.rstrip('/') if path.endswith('/') else path + '/'
+            if route_resolve(router, {**scope, 'path': path_redirect})[1] != Match.NONE:
+                return None, None
+        return None, HTTPException(status_code=404)
+
+    if match == Match.PARTIAL:
+        headers = (
+            {'Allow': ', '.join(sorted(route.methods))} if getattr(route, 'methods', None) else None
+        )
+        return None, HTTPException(status_code=405, headers=headers)
+
+    return route, None
+
+
+async def body_preflight(route: BaseRoute | None, body: dict | list | None) -> Exception | None:
+    """
+    Validates the body of a sub-request against the input schema of the route
+    without touching the database. Returns the error the route would raise
+    """
+    if not isinstance(route, APIRoute):
+        return None
+
+    body_fields, embed_body_fields = route_body_fields(route)
+    if not body_fields:
+        return None
+
+    _, errors = await request_body_to_args(body_fields, body, embed_body_fields)
+    if errors:
+        return RequestValidationError(errors, body=body)
+    return None
+
+
+async def item_preflight(
+    app: FastAPI, item: schemas.BulkPackageItemSchema
+) -> list[Exception | None]:
+    """
+    Returns the errors of the sub-requests of a package item, a batch item gives one per body.
+    The route of a batch is resolved once, its bodies are validated against the route
+    """
+    route, error = endpoint_preflight(app, item.endpoint, item.method)
+    if not isinstance(item, schemas.BulkBatchItemSchema):
+        return [error or await body_preflight(route, item.body)]
+    if error is not None:
+        return [error] * len(item.bodies)
+    return [await body_preflight(route, body) for body in item.bodies]
+
+
+async def items_preflight(
+    request: Request, app: FastAPI, state: dict, items: Sequence[schemas.BulkPackageItemSchema]
+) -> list[bytes] | None:
+    """
+    Validates all the items of an atomic package before the transaction is opened.
+    If any item fails, returns the encoded results of the rejected package: the failed items
+    contain their errors, the other items are not executed and have the 424 status
+    """
+    errors = [await item_preflight(app, item) for item in items]
+    if not any(error for item_errors in errors for error in item_errors):
+        return None
+
+    results = []
+    for item, item_errors in zip(items, errors, strict=True):
+        is_batch = isinstance(item, schemas.BulkBatchItemSchema)
+        encoded = []
+        for index, error in enumerate(item_errors):
+            result = {
+                'endpoint': item.endpoint,
+            }
+            if error is None:
+                result.update(status=STATUS_DEPENDENCY_FAILED, headers=[])
+            else:
+                if is_batch:
+                    # the failed body is prepared as a single sub-request to render its error
+                    item_failed = schemas.BulkRequestItemSchema(
+                        endpoint=item.endpoint,
+                        method=item.method,
+                        body=item.bodies[index],
+                        headers=item.headers,
+                    )
+                else:
+                    item_failed = item
+                prepared = item_prepare(request, app, state, item_failed)
+                await exception_dispatch(app, prepared.scope, error, sender_make(result))
+            # the results of a batch do not repeat its endpoint
+            if is_batch:
+                del result['endpoint']
+            encoded.append(item_encode(result))
+
+        # the results of a batch are collected into its compact array
+        results.append(batch_encode(item.endpoint, encoded) if is_batch else encoded[0])
+    return results
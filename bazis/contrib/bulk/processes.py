@@ -0,0 +1,272 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from starlette.requests import Request
+
+from pydantic import TypeAdapter
+
+from . import schemas
+from .auth import BULK_IDENTITY, identity_resolve
+from .costs import cost_model
+from .executor import STATUS_CLIENT_CLOSED, BulkPackage, items_run
+from .lanes import bulk_lanes
+from .metrics import bulk_metrics
+from .results import BulkResults
+from .utils import SAFE_METHODS, ThreadDedicated
+
+
+# the keys of the scope of the package request that are passed to the worker processes
+SCOPE_KEYS = (
+    'type',
+    'asgi',
+    'http_version',
+    'server',
+    'client',
+    'scheme',
+    'method',
+    'root_path',
+    'path',
+    'query_string',
+    'headers',
+)
+
+items_adapter = TypeAdapter(list[schemas.BulkPackageItemSchema])
+
+process_pool = None
+process_pool_lock = Lock()
+
+# the event loop of the worker process
+worker_loop = None
+
+
+def worker_init():
+    """
+    Prepares the worker process once for the life of the pool: sets up Django,
+    builds the application and opens the event loop
+    """
+    global worker_loop
+    from bazis.core.app import app  # noqa: F401
+
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+
+
+def worker_ping() -> int:
+    return os.getpid()
+
+
+async def receive_empty() -> dict:
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def shard_run(
+    scope: dict,
+    items: list[dict],
+    deadline: float | None,
+    item_timeout: float | None,
+    tenant: str,
+) -> tuple[bytes, int]:
+    from bazis.core.app import app
+
+    request = Request({**scope, 'state': {}}, receive_empty)
+    if deadline is not None:
+        deadline = asyncio.get_running_loop().time() + deadline - time.time()
+
+    results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+    try:
+        # the sync code of the shard, the identity included, runs in its own dedicated thread:
+        # the database connection is opened for the shard and is dropped with the thread,
+        # so a connection that outlived CONN_MAX_AGE or is broken is not used by the next shard
+        async with ThreadDedicated(is_transactional=False) as thread:
+            # the identity is resolved by the worker from the headers of the package request
+            identity = await identity_resolve(request)
+            package = BulkPackage(
+                request=request,
+                app=app,
+                state={BULK_IDENTITY: identity},
+                items=items_adapter.validate_python(items),
+                is_atomic=False,
+                deadline=deadline,
+                item_timeout=item_timeout,
+                tenant=tenant,
+            )
+            await items_run(package, thread, results)
+        return results.getvalue(), len(results)
+    finally:
+        results.close()
+
+
+def shard_execute(
+    scope: dict,
+    items: list[dict],
+    deadline: float | None,
+    item_timeout: float | None,
+    tenant: str,
+) -> tuple[bytes, int, dict[str, float], list[tuple[str, float]]]:
+    """
+    Executes the shard of the package items in the worker process.
+    Returns the encoded JSON array of the results, their number, the metrics and the observed
+    durations of the shard: they are applied by the process of the package
+    """
+    # the connections of the main thread of the worker, the shard uses a connection of its own
+    close_old_connections()
+    bulk_metrics.reset()
+    cost_model.observations = []
+    try:
+        content, count = worker_loop.run_until_complete(
+            shard_run(scope, items, deadline, item_timeout, tenant)
+        )
+        return content, count, bulk_metrics.snapshot(), cost_model.observations
+    finally:
+        cost_model.observations = None
+        close_old_connections()
+
+
+def process_pool_get() -> ProcessPoolExecutor:
+    """
+    Returns the process pool of the packages. The workers are started and set up
+    with the first sharded package, then they are reused by the next ones
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is None:
+            process_pool = ProcessPoolExecutor(
+                max_workers=settings.BAZIS_BULK_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=worker_init,
+            )
+            for _ in range(settings.BAZIS_BULK_PROCESSES):
+                process_pool.submit(worker_ping)
+        return process_pool
+
+
+def process_pool_reset(pool: ProcessPoolExecutor):
+    """
+    Drops the broken process pool, the next package starts a new one
+    """
+    global process_pool
+    with process_pool_lock:
+        if process_pool is pool:
+            process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def package_is_sharded(items: Sequence[schemas.BulkPackageItemSchema], is_atomic: bool) -> bool:
+    """
+    Whether the package is executed by the process pool: a non-atomic package of reading items,
+    large enough to pay for the transfer to the workers. The reading items do not depend
+    on each other, so they may be executed in any order
+    """
+    if settings.BAZIS_BULK_PROCESSES is None or is_atomic:
+        return False
+    if len(items) < settings.BAZIS_BULK_PROCESSES_ITEMS_MIN:
+        return False
+    return all(item.method.upper() in SAFE_METHODS for item in items)
+
+
+async def items_shard_execute(package: BulkPackage) -> tuple[BulkResults, int]:
+    """
+    Executes the package items by shards in the worker processes and merges their results
+    in the order of the items. Returns the results and the status of the package.
+    A shard occupies a worker process like a package occupies a worker thread: the first shard
+    runs in the slot of the package lane, every next concurrent shard takes a free slot of the lane.
+    The shards are submitted one by one, so after the client disconnects no new shard is started
+    """
+    loop = asyncio.get_running_loop()
+    pool = process_pool_get()
+
+    scope = {key: package.request.scope.get(key) for key in SCOPE_KEYS}
+    # the deadline is passed by the wall clock, the event loops of the processes differ
+    deadline = None
+    if package.deadline is not None:
+        deadline = time.time() + package.deadline - loop.time()
+
+    items = [item.model_dump() for item in package.items]
+    size = settings.BAZIS_BULK_PROCESSES_SHARD_SIZE
+    pending = deque(enumerate(range(0, len(items), size)))
+    shards = len(pending)
+    outcomes = {}
+
+    async def shards_run():
+        while pending:
+            # nobody will see the results of the remaining shards
+            if package.disconnected and package.disconnected.is_set():
+                return
+            index, start = pending.popleft()
+            content, count, counters, observations = await loop.run_in_executor(
+                pool,
+                shard_execute,
+                scope,
+                items[start : start + size],
+                deadline,
+                package.item_timeout,
+                package.tenant,
+            )
+            outcomes[index] = content, count
+            # the metrics and the learned durations of the worker are kept by this process
+            bulk_metrics.merge(counters)
+            for key, duration in observations:
+                cost_model.observe(key, duration)
+
+    async def shards_run_extra():
+        if not pending or not bulk_lanes.slot_try(package.lane):
+            return
+        try:
+            await shards_run()
+        finally:
+            bulk_lanes.slot_release(package.lane)
+
+    bulk_metrics.inc('packages_sharded')
+    bulk_metrics.inc('shards', shards)
+
+    results = BulkResults(settings.BAZIS_BULK_SPOOL_SIZE)
+    try:
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                task_group.create_task(shards_run())
+                for _ in range(min(settings.BAZIS_BULK_PROCESSES, shards) - 1):
+                    task_group.create_task(shards_run_extra())
+        except BaseExceptionGroup as e:
+            if e.subgroup(BrokenProcessPool) is not None:
+                process_pool_reset(pool)
+            # the package fails with the error of the shard, as with the error of an item
+            raise e.exceptions[0] from None
+
+        # the results are merged up to the first shard that was not started
+        for index in range(shards):
+            if index not in outcomes:
+                break
+            results.merge(*outcomes[index])
+    except BaseException:
+        results.close()
+        raise
+
+    if len(results) < len(items):
+        bulk_metrics.inc('packages_aborted')
+        bulk_metrics.inc('items_aborted', len(items) - len(results))
+        return results, STATUS_CLIENT_CLOSED
+    return results, 200
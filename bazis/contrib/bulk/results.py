@@ -0,0 +1,150 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import AsyncIterator, Iterable
+from tempfile import SpooledTemporaryFile
+
+from starlette.concurrency import run_in_threadpool
+
+from .encoders import BATCH_TAIL, batch_head_encode, item_write
+
+
+# size of the chunks the spilled results are streamed with, bytes
+RESULTS_CHUNK_SIZE = 64 * 1024
+
+
+class BulkResults:
+    """
+    Encoded results of the package items, joined into the JSON array as they are added.
+    Up to `spool_size` bytes are kept in memory, the larger results are spilled
+    to a temporary file and streamed back from it
+    """
+
+    def __init__(self, spool_size: int):
+        self.spool_size = spool_size
+        self.file = SpooledTemporaryFile(max_size=spool_size)
+        self.count = 0
+        self.size = 0
+        self.is_finished = False
+        # the number of the results of the open batch
+        self.batch_count = None
+        # the offsets of the results of the package items in the storage
+        self.offsets = []
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def is_spilled(self) -> bool:
+        return self.size > self.spool_size
+
+    def _write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+
+    def _open(self):
+        self._write(b',' if self.count else b'[')
+        self.offsets.append(self.size)
+
+    def append(self, item: bytes):
+        self._open()
+        self._write(item)
+        self.count += 1
+
+    def append_item(self, result: dict):
+        """
+        Encodes the result of a package item directly into the storage.
+        In the open batch, the result is added to its compact array without the endpoint
+        """
+        if self.batch_count is None:
+            self._open()
+            item_write(result, self._write)
+            self.count += 1
+            return
+
+        result.pop('endpoint', None)
+        if self.batch_count:
+            self._write(b',')
+        item_write(result, self._write)
+        self.batch_count += 1
+
+    def batch_begin(self, endpoint: str):
+        """
+        Opens the result of a batch item: its endpoint and the array of the results of its bodies
+        """
+        self._open()
+        self._write(batch_head_encode(endpoint))
+        self.batch_count = 0
+
+    def batch_end(self):
+        if self.batch_count is not None:
+            self._write(BATCH_TAIL)
+            self.count += 1
+            self.batch_count = None
+
+    def merge(self, results: bytes, count: int):
+        """
+        Appends the encoded JSON array of `count` results, such as the results of a shard.
+        The merged results are not addressed by `read`
+        """
+        if count:
+            self._write(b',' if self.count else b'[')
+            self._write(results[1:-1])
+            self.count += count
+
+    def extend(self, items: Iterable[bytes]):
+        for item in items:
+            self.append(item)
+
+    def finish(self):
+        """
+        Closes the JSON array, no more results can be added
+        """
+        if not self.is_finished:
+            self._write(b']' if self.count else b'[]')
+            self.is_finished = True
+
+    def read(self, index: int) -> bytes:
+        """
+        Returns the encoded result of the package item by its index
+        """
+        self.finish()
+        start = self.offsets[index]
+        # the result ends before the comma of the next one or the end of the array
+        end = self.offsets[index + 1] - 1 if index + 1 < len(self.offsets) else self.size - 1
+        self.file.seek(start)
+        return self.file.read(end - start)
+
+    def getvalue(self) -> bytes:
+        """
+        Returns the whole JSON array of the results
+        """
+        self.finish()
+        self.file.seek(0)
+        return self.file.read()
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """
+        Yields the JSON array of the results by chunks and closes the storage
+        """
+        self.finish()
+        self.file.seek(0)
+        try:
+            while chunk := await run_in_threadpool(self.file.read, RESULTS_CHUNK_SIZE):
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,80 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+from threading import Lock
+
+from django.conf import settings
+
+
+# serialization_failure and deadlock_detected: the transaction can succeed if it is repeated
+RETRY_SQLSTATES = frozenset(('40001', '40P01'))
+
+
+def sqlstate_get(exc: BaseException | None) -> str | None:
+    """
+    Returns the SQLSTATE of the database error that caused the exception.
+    Django wraps the errors of the driver, so the whole chain of causes is checked
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if sqlstate := getattr(exc, 'sqlstate', None) or getattr(exc, 'pgcode', None):
+            return sqlstate
+        exc = exc.__cause__ or exc.__context__
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    return sqlstate_get(exc) in RETRY_SQLSTATES
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Returns the delay before the retry in seconds: the exponential backoff with the full jitter
+    """
+    delay = min(
+        settings.BAZIS_BULK_RETRY_DELAY * 2 ** (attempt - 1), settings.BAZIS_BULK_RETRY_DELAY_MAX
+    )
+    return random.uniform(0, delay) / 1000
+
+
+class RetryBudget:
+    """
+    Process-wide limit of the retries. Each retry takes a token, each package that is completed
+    without retries returns a part of the token. When there are no tokens, the packages
+    are not retried: under a persistent conflict the retries would only multiply the load
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.tokens = None
+
+    def acquire(self) -> bool:
+        with self.lock:
+            if self.tokens is None:
+                self.tokens = float(settings.BAZIS_BULK_RETRY_BUDGET)
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def deposit(self):
+        with self.lock:
+            tokens_max = float(settings.BAZIS_BULK_RETRY_BUDGET)
+            tokens = tokens_max if self.tokens is None else self.tokens
+            self.tokens = min(tokens_max, tokens + settings.BAZIS_BULK_RETRY_BUDGET_RATIO)
+
+
+retry_budget = RetryBudget()
@@ -12,110 +12,372 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import json
-from urllib.parse import urlparse
+from contextlib import aclosing
+from typing import Literal
 
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
-from fastapi import Request, Response
+from fastapi import Depends, HTTPException, Query, Request, Response
+
+from starlette.responses import StreamingResponse
 
 from bazis.core.routing import BazisRouter
 
 from . import schemas
-from .utils import ThreadDedicated, ThreadsPool
+from .auth import BULK_IDENTITY, identity_owner, identity_resolve, identity_tenant
+from .costs import batches_charge, cost_charge
+from .encoders import envelope_encode
+from .executor import BulkPackage, BulkRollbackError, disconnect_watch, items_execute  # noqa: F401
+from .groups import groups_execute, package_is_grouped
+from .idempotency import idempotency_get
+from .imports import (
+    batches_execute,
+    batches_read,
+    import_format_get,
+    mapping_parse,
+    rows_csv,
+    rows_ndjson,
+)
+from .lanes import LANE_BATCH, bulk_lanes, lane_select
+from .metrics import bulk_metrics
+from .preflight import items_preflight, preflight_is_enabled
+from .processes import items_shard_execute, package_is_sharded
+from .results import BulkResults
+from .retry import is_retryable, retry_budget, retry_delay
+from .utils import (
+    SAFE_METHODS,
+    ThreadDedicated,
+    ThreadsPool,
+    timeout_resolve,
+    transaction_options_resolve,
+)
 
 
 router = BazisRouter(tags=[_('Bulk requests')])
 
 
-class BulkRollbackError(Exception): ...
+def thread_autocommit_make(is_cancellable: bool, is_diagnosed: bool) -> ThreadsPool:
+    """
+    Selects the thread behavior of the items executed without the transaction
+    """
+    if is_cancellable or is_diagnosed:
+        return ThreadDedicated(is_transactional=False, is_diagnosed=is_diagnosed)
+    return ThreadsPool()
+
+
+def thread_behavior_make(
+    items: list[schemas.BulkPackageItemSchema],
+    options: schemas.BulkTransactionSchema,
+    is_atomic: bool,
+    is_snapshot: bool,
+    is_idempotent: bool = False,
+    is_cancellable: bool = False,
+    is_diagnosed: bool = False,
+) -> ThreadsPool:
+    """
+    Selects the thread behavior of the package.
+    The items of the cancellable package are executed in the dedicated thread,
+    whose running query can be cancelled by the timeout. The items of the diagnosed package
+    are executed in the dedicated thread too, whose statements are recorded
+    """
+    if not is_atomic:
+        return thread_autocommit_make(is_cancellable, is_diagnosed)
+    if is_idempotent or any(item.method.upper() not in SAFE_METHODS for item in items):
+        # the transaction is started by the first item that changes the data
+        return ThreadDedicated(
+            is_lazy=True, options=transaction_options_resolve(options), is_diagnosed=is_diagnosed
+        )
+    if is_snapshot:
+        # the reading items see the same state of the database
+        options = options.model_copy(
+            update={'isolation_level': 'repeatable_read', 'is_read_only': True}
+        )
+        return ThreadDedicated(
+            options=transaction_options_resolve(options), is_diagnosed=is_diagnosed
+        )
+    # the reading items do not need the transaction
+    return thread_autocommit_make(is_cancellable, is_diagnosed)
+
+
+def idempotency_check(
+    items: list[schemas.BulkPackageItemSchema],
+    is_atomic: bool,
+    options: schemas.BulkTransactionSchema,
+):
+    """
+    Rejects the idempotency key of the package that cannot be executed with it
+    """
+    if not is_atomic or package_is_grouped(items, is_atomic):
+        raise HTTPException(
+            status_code=400,
+            detail=_(
+                'Idempotency keys are supported in the transactional mode without groups only'
+            ),
+        )
+    # the snapshot of such a transaction is taken before the key is locked, so the result
+    # stored by the concurrent package with the same key would not be seen
+    if transaction_options_resolve(options).isolation_level in ('repeatable_read', 'serializable'):
+        raise HTTPException(
+            status_code=400,
+            detail=_('Idempotency keys are not supported with the snapshot isolation levels'),
+        )
+
+
+def retries_resolve(retries: int | None, is_atomic: bool) -> int:
+    """
+    Returns the maximum number of the retries of the package: an atomic package rolled back
+    by a serialization failure or a deadlock is replayed
+    """
+    if not is_atomic:
+        return 0
+    return min(
+        settings.BAZIS_BULK_RETRIES if retries is None else retries,
+        settings.BAZIS_BULK_RETRIES_MAX,
+    )
+
+
+async def package_execute(
+    package: BulkPackage,
+    options: schemas.BulkTransactionSchema,
+    is_snapshot: bool,
+    is_cancellable: bool,
+    retries_max: int = 0,
+) -> tuple[BulkResults | bytes, int, dict]:
+    """
+    Executes the package within its thread behavior. Returns the results, the status
+    and the headers of the package.
+    The large reading package is executed by the worker processes, if they are enabled.
+    The groups of the items are executed concurrently, each in its own transaction.
+    The statements of the diagnosed package are recorded in this process
+    """
+    if not package.is_diagnosed and package_is_sharded(package.items, package.is_atomic):
+        return *await items_shard_execute(package), {}
 
+    if package_is_grouped(package.items, package.is_atomic):
+        results, status_code, statuses = await groups_execute(
+            package, transaction_options_resolve(options), retries_max
+        )
+        return results, status_code, {'X-Bulk-Groups': json.dumps(statuses, separators=(',', ':'))}
 
-@router.post('/bulk/', response_model=list[schemas.BulkResponseItemSchema])
+    thread_behavior = thread_behavior_make(
+        package.items,
+        options,
+        package.is_atomic,
+        is_snapshot,
+        is_idempotent=package.idempotency is not None,
+        is_cancellable=is_cancellable,
+        is_diagnosed=package.is_diagnosed,
+    )
+    return *await items_execute(package, thread_behavior), {}
+
+
+def response_make(content: BulkResults | bytes, status_code: int, headers: dict) -> Response:
+    """
+    Builds the response of the package. The results spilled to disk are streamed from the file
+    """
+    if isinstance(content, BulkResults):
+        content.finish()
+        if content.is_spilled:
+            return StreamingResponse(
+                content.stream(),
+                status_code=status_code,
+                media_type='application/json',
+                headers={**headers, 'Content-Length': str(content.size)},
+            )
+        results = content
+        try:
+            content = results.getvalue()
+        finally:
+            results.close()
+
+    return Response(
+        content=content,
+        status_code=status_code,
+        media_type='application/json',
+        headers=headers,
+    )
+
+
+@router.post(
+    '/bulk/',
+    response_model=list[schemas.BulkResponseItemSchema | schemas.BulkBatchResponseSchema],
+)
 async def bulk(
     request: Request,
-    response: Response,
-    items: list[schemas.BulkRequestItemSchema],
+    items: list[schemas.BulkPackageItemSchema],
+    options: schemas.BulkTransactionSchema = Depends(),
+    is_atomic: bool = True,
+    is_snapshot: bool = False,
+    retries: int | None = Query(None, ge=0),
+    deadline_ms: int | None = Query(None, gt=0),
+    item_timeout_ms: int | None = Query(None, gt=0),
+    lane: Literal['interactive', 'batch'] | None = None,
+    diagnostics: bool = False,
+):
+    from bazis.core.app import app
+
+    # the deadline is counted from the receipt of the package
+    time_start = asyncio.get_running_loop().time()
+
+    if diagnostics and not settings.BAZIS_BULK_DIAGNOSTICS:
+        raise HTTPException(status_code=400, detail=_('Diagnostics of the packages are disabled'))
+
+    # the identity is resolved once for all the package items
+    identity = await identity_resolve(request)
+    state = {**request.scope.get('state', {}), BULK_IDENTITY: identity}
+
+    # an atomic package with invalid items is rejected before the transaction is opened,
+    # the groups are validated alone
+    if is_atomic and not package_is_grouped(items, is_atomic) and preflight_is_enabled(identity):
+        results = await items_preflight(request, app, state, items)
+        if results is not None:
+            return Response(
+                content=envelope_encode(results),
+                status_code=400,
+                media_type='application/json',
+            )
+
+    # the result of a package with the idempotency key is stored in the package transaction
+    idempotency = await idempotency_get(request, identity)
+    if idempotency:
+        idempotency_check(items, is_atomic, options)
+
+    # the package is charged against the cost budgets before it is executed
+    await cost_charge(app, identity_owner(identity), items)
+
+    retries_max = retries_resolve(retries, is_atomic)
+    deadline_ms = timeout_resolve(deadline_ms, 'BAZIS_BULK_DEADLINE', 'BAZIS_BULK_DEADLINE_MAX')
+    item_timeout_ms = timeout_resolve(
+        item_timeout_ms, 'BAZIS_BULK_ITEM_TIMEOUT', 'BAZIS_BULK_ITEM_TIMEOUT_MAX'
+    )
+
+    package = BulkPackage(
+        request=request,
+        app=app,
+        state=state,
+        items=items,
+        is_atomic=is_atomic,
+        idempotency=idempotency,
+        deadline=time_start + deadline_ms / 1000 if deadline_ms else None,
+        item_timeout=item_timeout_ms / 1000 if item_timeout_ms else None,
+        tenant=identity_tenant(identity),
+        lane=lane_select(items, lane),
+        is_diagnosed=diagnostics,
+    )
+
+    attempt = 0
+    # the package waits for a slot of its lane, the retries are executed in the same slot
+    async with (
+        disconnect_watch(request) as package.disconnected,
+        bulk_lanes.slot(package.lane),
+    ):
+        while True:
+            try:
+                content, status_code, headers = await package_execute(
+                    package,
+                    options,
+                    is_snapshot,
+                    is_cancellable=bool(deadline_ms or item_timeout_ms),
+                    retries_max=retries_max,
+                )
+                break
+            except Exception as e:
+                if not is_retryable(e) or package.disconnected.is_set():
+                    raise
+                # the replay would not complete before the deadline
+                if package.deadline and package.deadline <= asyncio.get_running_loop().time():
+                    raise
+                if attempt >= retries_max:
+                    if retries_max:
+                        bulk_metrics.inc('retries_exhausted')
+                    raise
+                if not retry_budget.acquire():
+                    bulk_metrics.inc('retries_budget_exhausted')
+                    raise
+                attempt += 1
+                bulk_metrics.inc('retries')
+                await asyncio.sleep(retry_delay(attempt))
+
+    bulk_metrics.inc('packages')
+    if attempt:
+        bulk_metrics.inc('packages_retried')
+    else:
+        retry_budget.deposit()
+
+    if retries_max:
+        headers['X-Bulk-Retries'] = str(attempt)
+    if idempotency and idempotency.is_replayed:
+        headers['Idempotency-Replayed'] = 'true'
+
+    return response_make(content, status_code, headers)
+
+
+@router.post('/bulk/import/', response_model=list[schemas.BulkResponseItemSchema])
+async def bulk_import(
+    request: Request,
+    endpoint: str,
+    resource_type: str,
+    mapping: str | None = None,
+    options: schemas.BulkTransactionSchema = Depends(),
     is_atomic: bool = True,
+    batch_size: int | None = Query(None, ge=1),
+    delimiter: str = Query(',', min_length=1, max_length=1),
 ):
+    """
+    Imports the NDJSON or CSV file streamed in the request body: every row creates a resource
+    by the POST sub-request to the endpoint. The rows are read and executed by batches,
+    so the memory does not depend on the size of the file
+    """
     from bazis.core.app import app
 
-    # collect the list of responses
-    results = []
+    import_format = import_format_get(request.headers.get('content-type'))
+    if import_format is None:
+        raise HTTPException(
+            status_code=415,
+            detail=_('The imported file must be sent as application/x-ndjson or text/csv'),
+        )
+    mapping = mapping_parse(mapping)
+    batch_size = min(
+        batch_size or settings.BAZIS_BULK_IMPORT_BATCH_SIZE,
+        settings.BAZIS_BULK_IMPORT_BATCH_SIZE_MAX,
+    )
 
-    if is_atomic:
-        thread_behavior = ThreadDedicated()
+    # the identity is resolved once for all the rows of the file
+    identity = await identity_resolve(request)
+    state = {**request.scope.get('state', {}), BULK_IDENTITY: identity}
+
+    # the body is read while the batches are executed
+    if import_format == 'csv':
+        rows = rows_csv(request.stream(), delimiter)
     else:
-        thread_behavior = ThreadsPool()
-
-    try:
-        async with thread_behavior as thread:
-            for item in items:  # type: schemas.BulkRequestItemSchema
-                # parse the endpoint
-                url = urlparse(item.endpoint)
-
-                # build the scope
-                scope = {
-                    'type': request.scope.get('type'),
-                    'asgi': request.scope.get('asgi'),
-                    'http_version': request.scope.get('http_version'),
-                    'server': request.scope.get('server'),
-                    'client': request.scope.get('client'),
-                    'scheme': request.scope.get('scheme'),
-                    'headers': request.scope['headers'],
-                    'method': item.method.upper(),
-                    'query_string': url.query and url.query.encode(),
-                    'path': url.path,
-                    'raw_path': url.path,
-                }
-
-                # build the response
-                result = {
-                    'endpoint': item.endpoint,
-                }
-
-                async def receive(_item=item):
-                    return {
-                        'type': 'http.request',
-                        'body': json.dumps(
-                            _item.body,
-                            ensure_ascii=False,
-                            allow_nan=False,
-                        ).encode("utf-8"),
-                    }
-
-                async def sender(_data, _result=result):
-                    if _data['type'] == 'http.response.start':
-                        _result['status'] = _data['status']
-                        _result['headers'] = _data['headers']
-                    if _data['type'] == 'http.response.body':
-                        # determine the content type
-                        content_type = dict(_result['headers']).get(b'content-type')
-                        if content_type and b'json' in content_type:
-                            _result['response'] = (
-                                json.loads(_data['body']) if _data['body'] else None
-                            )
-                        else:
-                            _result['response'] = _data['body']
-
-                # run the route execution in a dedicated thread (since we are in the context of this thread)
-                await app.__call__(scope, receive, sender)
-                # if an exception occurred inside the dedicated thread - the transaction needs to be restarted
-                await thread.check()
-
-                # for any incorrect response of a package item - we make the overall package status non-working
-                if is_atomic and result['status'] >= 400:
-                    response.status_code = 400
-                results.append(result)
-
-            if not response.status_code:
-                response.status_code = 200
-
-            # if the status is non-working - roll back the transaction
-            if response.status_code >= 400:
-                raise BulkRollbackError
-
-    except BulkRollbackError:
-        pass
-
-    return results
+        rows = rows_ndjson(request.stream())
+
+    # the import is executed in the lane of the large packages,
+    # every batch is charged against the cost budgets
+    async with (
+        bulk_lanes.slot(LANE_BATCH),
+        aclosing(batches_read(rows, endpoint, resource_type, mapping, batch_size)) as batches,
+        aclosing(batches_charge(app, identity_owner(identity), batches)) as batches,
+    ):
+        results, batches_count, batches_failed = await batches_execute(
+            request,
+            app,
+            state,
+            batches,
+            transaction_options_resolve(options),
+            is_atomic,
+            identity_tenant(identity),
+            endpoint,
+        )
+
+    bulk_metrics.inc('imports')
+    bulk_metrics.inc('imports_batches', batches_count)
+
+    headers = {
+        'X-Bulk-Batches': str(batches_count),
+        'X-Bulk-Batches-Failed': str(batches_failed),
+    }
+    return response_make(results, 400 if is_atomic and batches_failed else 200, headers)
@@ -0,0 +1,133 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import heapq
+import itertools
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from .metrics import bulk_metrics
+
+
+# number of the tenants whose tags are kept after which the idle ones are dropped
+SCHEDULER_TENANTS_MAX = 10000
+
+# set while the sub-request holds a slot: a nested package does not wait for another one
+slot_held: ContextVar[bool] = ContextVar('bulk_scheduler_slot_held', default=False)
+
+
+class BulkScheduler:
+    """
+    Fair queuing of the sub-requests of the packages between the tenants.
+    At most `BAZIS_BULK_SCHEDULER_SLOTS` sub-requests are executed at once. When all the slots are
+    busy, a freed slot is given to the waiting sub-request with the smallest start tag:
+    every sub-request of a tenant advances its tag by the inverse of its share, so the tenants
+    get the slots in proportion to their shares, whatever the sizes of their packages
+    """
+
+    def __init__(self):
+        self.busy = 0
+        # the start tag of the last sub-request given a slot
+        self.virtual_time = 0.0
+        # the finish tags of the last sub-requests of the tenants
+        self.finishes = {}
+        self.waiters = []
+        self.sequence = itertools.count()
+
+    @property
+    def is_enabled(self) -> bool:
+        return settings.BAZIS_BULK_SCHEDULER_SLOTS is not None
+
+    @property
+    def queue_size(self) -> int:
+        return sum(1 for it in self.waiters if not it[2].done())
+
+    def share_get(self, tenant: str) -> float:
+        return settings.BAZIS_BULK_SCHEDULER_SHARES.get(
+            tenant, settings.BAZIS_BULK_SCHEDULER_SHARE_DEFAULT
+        )
+
+    def _tag(self, tenant: str) -> float:
+        if len(self.finishes) >= SCHEDULER_TENANTS_MAX:
+            # the tags behind the virtual time do not change the order
+            self.finishes = {key: it for key, it in self.finishes.items() if it > self.virtual_time}
+        start = max(self.virtual_time, self.finishes.get(tenant, 0.0))
+        self.finishes[tenant] = start + 1 / self.share_get(tenant)
+        return start
+
+    def _release(self):
+        while self.waiters:
+            tag, _, future = heapq.heappop(self.waiters)
+            # the waiter was cancelled
+            if future.done():
+                continue
+            # the slot is handed over to the waiter
+            self.virtual_time = tag
+            future.set_result(None)
+            return
+        self.busy -= 1
+
+    async def _acquire(self, tenant: str):
+        tag = self._tag(tenant)
+        if self.busy < settings.BAZIS_BULK_SCHEDULER_SLOTS and not self.queue_size:
+            self.busy += 1
+            self.virtual_time = max(self.virtual_time, tag)
+            return
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        heapq.heappush(self.waiters, (tag, next(self.sequence), future))
+        time_start = loop.time()
+        bulk_metrics.inc('scheduler_queued')
+        try:
+            await future
+        except asyncio.CancelledError:
+            # the slot was handed over right before the cancellation
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+        wait = loop.time() - time_start
+        bulk_metrics.observe('scheduler_wait', wait)
+        bulk_metrics.observe(f'scheduler_wait:{tenant}', wait)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str) -> AsyncIterator[None]:
+        """
+        Holds a slot of the scheduler while the sub-request of the tenant is executed
+        """
+        if not self.is_enabled or slot_held.get():
+            yield
+            return
+
+        await self._acquire(tenant)
+        token = slot_held.set(True)
+        try:
+            yield
+        finally:
+            slot_held.reset(token)
+            self._release()
+
+    def reset(self):
+        self.busy = 0
+        self.virtual_time = 0.0
+        self.finishes.clear()
+        self.waiters.clear()
+
+
+bulk_scheduler = BulkScheduler()
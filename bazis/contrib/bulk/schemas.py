@@ -12,16 +12,44 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any
+from typing import Annotated, Any, Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Discriminator, Field, Tag
 
 
 class BulkRequestItemSchema(BaseModel):
     endpoint: str
     method: str = 'GET'
-    body: dict | None = None
+    # the list body is sent by a nested package
+    body: dict | list | None = None
     headers: list[tuple[str, Any]] | None = None
+    # the items of a group are executed in their own transaction,
+    # the empty name is reserved for the items without the group
+    group: str | None = Field(None, min_length=1)
+
+
+class BulkBatchItemSchema(BaseModel):
+    """
+    Batch of the package: the sub-requests with the same endpoint and method and different bodies
+    """
+
+    endpoint: str
+    method: str = 'POST'
+    bodies: list[dict | None] = Field(min_length=1)
+    headers: list[tuple[str, Any]] | None = None
+    group: str | None = Field(None, min_length=1)
+
+
+def package_item_tag(value: Any) -> str:
+    if isinstance(value, dict):
+        return 'batch' if 'bodies' in value else 'item'
+    return 'batch' if isinstance(value, BulkBatchItemSchema) else 'item'
+
+
+BulkPackageItemSchema = Annotated[
+    Annotated[BulkRequestItemSchema, Tag('item')] | Annotated[BulkBatchItemSchema, Tag('batch')],
+    Discriminator(package_item_tag),
+]
 
 
 class BulkResponseItemSchema(BaseModel):
@@ -29,3 +57,29 @@ class BulkResponseItemSchema(BaseModel):
     status: int
     response: str | dict | None
     headers: list[tuple[str, Any]]
+    # the report of the statements of the item, in the diagnostic mode only
+    diagnostics: dict | None = None
+
+
+class BulkBatchResultSchema(BaseModel):
+    status: int
+    response: str | dict | None
+    headers: list[tuple[str, Any]]
+    diagnostics: dict | None = None
+
+
+class BulkBatchResponseSchema(BaseModel):
+    endpoint: str
+    results: list[BulkBatchResultSchema]
+
+
+class BulkTransactionSchema(BaseModel):
+    """
+    Options of the transaction of an atomic package. The timeouts are set in milliseconds
+    """
+
+    isolation_level: Literal['read_committed', 'repeatable_read', 'serializable'] | None = None
+    is_read_only: bool | None = None
+    lock_timeout: int | None = Field(None, ge=0)
+    statement_timeout: int | None = Field(None, ge=0)
+    idle_in_transaction_session_timeout: int | None = Field(None, ge=0)
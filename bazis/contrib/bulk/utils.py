@@ -14,24 +14,62 @@
 
 import asyncio
 import sys
+import time
 from collections import deque
 from contextvars import ContextVar, copy_context
 from typing import Any
 
-from django.db import transaction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
 
+from anyio import CapacityLimiter, WouldBlock
 from anyio._backends._asyncio import (
     AsyncIOBackend,
+    _default_thread_limiter,
     _threadpool_idle_workers,
     _threadpool_workers,
     find_root_task,
 )
 from anyio._backends._asyncio import WorkerThread as BaseWorkerThread
+from anyio.lowlevel import RunVar
 from sniffio import current_async_library_cvar
 
+from .cache import BulkCache, bulk_cache_var
+from .diagnostics import QueryRecorder
+from .metrics import bulk_metrics
+from .schemas import BulkTransactionSchema
+
 
 worker_dedicated = ContextVar('worker_dedicated')
 
+# the limiter of the worker threads of the sub-requests in the context of a package
+thread_limiter_var = ContextVar('bulk_thread_limiter', default=None)
+
+# the limiter of the worker threads of the packages of the event loop
+bulk_limiter_var = RunVar('bulk_thread_limiter')
+
+# the number of the packages of the event loop that need the patched thread pool
+threadpool_patches = RunVar('bulk_threadpool_patches', default=0)
+
+# methods of the package items that do not change the data
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+ISOLATION_LEVELS = {
+    'read_committed': 'READ COMMITTED',
+    'repeatable_read': 'REPEATABLE READ',
+    'serializable': 'SERIALIZABLE',
+}
+
+# transaction timeouts: the setting of the default value and the setting of the maximum value
+TIMEOUTS = {
+    'lock_timeout': ('BAZIS_BULK_LOCK_TIMEOUT', 'BAZIS_BULK_LOCK_TIMEOUT_MAX'),
+    'statement_timeout': ('BAZIS_BULK_STATEMENT_TIMEOUT', 'BAZIS_BULK_STATEMENT_TIMEOUT_MAX'),
+    'idle_in_transaction_session_timeout': (
+        'BAZIS_BULK_IDLE_TIMEOUT',
+        'BAZIS_BULK_IDLE_TIMEOUT_MAX',
+    ),
+}
+
 
 # BaseWorkerThread_run = BaseWorkerThread.run
 # def run_close_all(self) -> None:
@@ -72,29 +110,243 @@ class IdleWorkersDeque(deque):
             return super().__getitem__(*args)
 
 
-def threadpool_vars_prepare():
+class LimiterHeld:
+    """
+    The limiter of the sub-requests of the dedicated thread, that holds the token itself
+    """
+
+    async def acquire_on_behalf_of(self, borrower: object): ...
+
+    def release_on_behalf_of(self, borrower: object): ...
+
+
+LIMITER_HELD = LimiterHeld()
+
+
+class ContextLimiter:
+    """
+    A patched default thread limiter of anyio. Inside a package, the sub-requests take the tokens
+    of the bulk limiter, so the packages and the other requests do not starve each other.
+    Outside the packages, the original default limiter is used
+    """
+
+    def __init__(self, limiter: CapacityLimiter):
+        self.limiter = limiter
+
+    def _limiter_get(self):
+        return thread_limiter_var.get() or self.limiter
+
+    async def __aenter__(self):
+        limiter = self._limiter_get()
+        if limiter is self.limiter:
+            await limiter.acquire()
+        else:
+            await bulk_limiter_acquire(limiter, asyncio.current_task())
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._limiter_get().release_on_behalf_of(asyncio.current_task())
+
+    @property
+    def total_tokens(self) -> float:
+        return self.limiter.total_tokens
+
+    @total_tokens.setter
+    def total_tokens(self, value: float):
+        self.limiter.total_tokens = value
+
+    def __getattr__(self, name):
+        return getattr(self.limiter, name)
+
+
+def idle_workers_swap(idle_workers: deque):
+    """
+    Replaces the deque of the idle workers of the event loop.
+    The workers are moved into the new deque and return to it after their tasks.
+    A call waiting for the limiter has read the previous deque, so the previous deque is emptied:
+    the call starts a new worker instead of taking the worker that is idle in the new deque
+    """
+    try:
+        workers = _threadpool_workers.get()
+        previous = _threadpool_idle_workers.get()
+    except LookupError:
+        workers = set()
+        _threadpool_workers.set(workers)
+    else:
+        # the length is checked, the patched deque is not empty in the context of a package
+        while len(previous):
+            idle_workers.append(previous.popleft())
+    for worker in workers:
+        # the worker started by such a call is idle in the deque read by the call
+        if worker.idle_workers is not idle_workers and worker in worker.idle_workers:
+            worker.idle_workers.remove(worker)
+            idle_workers.append(worker)
+        worker.idle_workers = idle_workers
+    _threadpool_idle_workers.set(idle_workers)
+
+
+def threadpool_patch():
+    """
+    Patches the thread pool of the event loop, when the first package is entered:
+    the idle workers give the dedicated thread in its context, the default limiter gives
+    the bulk limiter in the context of a package.
+    While no package is executed, the thread pool of anyio is not patched and the other
+    requests do not pay for it
+    """
+    count = threadpool_patches.get()
+    threadpool_patches.set(count + 1)
+    if count:
+        return
+
+    idle_workers_swap(IdleWorkersDeque())
+    if settings.BAZIS_BULK_THREADS is not None:
+        limiter = AsyncIOBackend.current_default_thread_limiter()
+        _default_thread_limiter.set(ContextLimiter(limiter))
+
+
+def threadpool_unpatch():
+    """
+    Restores the thread pool of anyio, when the last package is exited
+    """
+    count = threadpool_patches.get() - 1
+    threadpool_patches.set(count)
+    if count:
+        return
+
+    idle_workers_swap(deque())
+    limiter = AsyncIOBackend.current_default_thread_limiter()
+    if isinstance(limiter, ContextLimiter):
+        _default_thread_limiter.set(limiter.limiter)
+
+
+def bulk_limiter_get() -> CapacityLimiter | None:
     """
-    Patching environment service variables to enable working with a dedicated thread
+    Returns the limiter of the worker threads of the packages, if it is enabled
     """
+    if settings.BAZIS_BULK_THREADS is None:
+        return None
     try:
-        _threadpool_idle_workers.get()
-        _threadpool_workers.get()
+        return bulk_limiter_var.get()
     except LookupError:
-        _threadpool_idle_workers.set(IdleWorkersDeque())
-        _threadpool_workers.set(set())
+        limiter = CapacityLimiter(settings.BAZIS_BULK_THREADS)
+        bulk_limiter_var.set(limiter)
+        return limiter
+
+
+async def bulk_limiter_acquire(limiter: CapacityLimiter | LimiterHeld, borrower: object):
+    """
+    Takes a token of the bulk limiter, the wait for it is registered in the metrics.
+    A free token is taken without a checkpoint: cancelled at it, anyio releases the token
+    on behalf of the current task instead of the borrower
+    """
+    if limiter is LIMITER_HELD:
+        return
+    try:
+        limiter.acquire_on_behalf_of_nowait(borrower)
+        return
+    except WouldBlock:
+        pass
+    bulk_metrics.inc('threads_queued')
+    time_start = time.monotonic()
+    await limiter.acquire_on_behalf_of(borrower)
+    bulk_metrics.observe('threads_wait', time.monotonic() - time_start)
+
+
+def bulk_threads_stats() -> dict[str, float]:
+    """
+    Returns the occupancy of the bulk limiter of the event loop
+    """
+    if (limiter := bulk_limiter_get()) is None:
+        return {}
+    statistics = limiter.statistics()
+    return {
+        'threads_total': limiter.total_tokens,
+        'threads_borrowed': statistics.borrowed_tokens,
+        'threads_waiting': statistics.tasks_waiting,
+    }
+
+
+def timeout_resolve(value: int | None, setting_default: str, setting_max: str) -> int | None:
+    """
+    Returns the timeout requested by the client or the default one, limited by the maximum
+    """
+    if value is None:
+        value = getattr(settings, setting_default)
+    values = [it for it in (value, getattr(settings, setting_max)) if it is not None]
+    return min(values) if values else None
+
+
+def transaction_options_resolve(options: BulkTransactionSchema | None) -> BulkTransactionSchema:
+    """
+    Completes the options of the package transaction with the defaults from the settings.
+    The timeouts are limited by the maximums from the settings
+    """
+    options = options or BulkTransactionSchema()
+    update = {'isolation_level': options.isolation_level or settings.BAZIS_BULK_ISOLATION_LEVEL}
+    for name, (setting_default, setting_max) in TIMEOUTS.items():
+        update[name] = timeout_resolve(getattr(options, name), setting_default, setting_max)
+    return options.model_copy(update=update)
+
+
+class BulkCancelledError(Exception):
+    """
+    Raised by the queries of a sub-request, that is cancelled by the timeout
+    """
 
 
 class ThreadsPool:
     """
-    Standard behavior of the thread pool
+    Standard behavior of the thread pool.
+    While the behavior is entered, the sub-requests share the memoization cache of the package
+    and take the worker threads by the tokens of the bulk limiter
     """
 
+    cache = None
+    cache_token = None
+    limiter_token = None
+    # the recorder of the statements of the sub-requests, only in the diagnostic mode
+    queries = None
+
     async def check(self): ...
 
+    async def item_enter(self, method: str): ...
+
+    async def item_exit(self, method: str):
+        # the values cached before the change may be based on the changed data
+        if method not in SAFE_METHODS:
+            self.cache.clear()
+
+    async def cancel(self): ...
+
+    async def cancel_reset(self): ...
+
+    def _cache_open(self):
+        self.cache = BulkCache()
+        self.cache_token = bulk_cache_var.set(self.cache)
+
+    def _cache_close(self):
+        bulk_cache_var.reset(self.cache_token)
+        self.cache.clear()
+
+    def _limiter_open(self):
+        # the nested package uses the limiter of the outer one
+        if thread_limiter_var.get() is None and (limiter := bulk_limiter_get()):
+            self.limiter_token = thread_limiter_var.set(limiter)
+
+    def _limiter_close(self):
+        if self.limiter_token is not None:
+            thread_limiter_var.reset(self.limiter_token)
+            self.limiter_token = None
+
     async def __aenter__(self):
+        threadpool_patch()
+        self._cache_open()
+        self._limiter_open()
         return self
 
-    async def __aexit__(self, exc_type, exc_value, traceback): ...
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self._limiter_close()
+        self._cache_close()
+        threadpool_unpatch()
 
 
 class DedicatedWorkerThread(BaseWorkerThread):
@@ -137,38 +389,182 @@ class ThreadDedicated(ThreadsPool):
     in the low-level library anyio._backends._asyncio, in the method of which
     the route is executed: anyio._backends._asyncio.run_sync_in_worker_thread.
     Thus, the goal of executing all routes in a single transaction is achieved.
+    The lazy transaction is started by the first item with a non-safe method,
+    the items before it are executed in the dedicated thread in the autocommit mode.
+    The options set the isolation level, the access mode and the timeouts of the transaction.
+    The non-transactional behavior only executes the items in the dedicated thread
+    in the autocommit mode, so that the running query of an item can be cancelled.
+    The dedicated thread holds a token of the bulk limiter while it lives.
+    In the diagnostic mode the statements executed in the dedicated thread are recorded
     """
 
-    def __init__(self, using=None):
+    def __init__(
+        self,
+        using=None,
+        is_lazy=False,
+        options: BulkTransactionSchema | None = None,
+        is_transactional=True,
+        is_diagnosed=False,
+    ):
+        self.using = using or DEFAULT_DB_ALIAS
         self.atomic = transaction.atomic(using=using)
+        self.is_transactional = is_transactional
+        self.options = options or BulkTransactionSchema()
+        # the items before the first write must see the snapshot of the requested isolation level
+        # or be read only, so such a transaction is started at once
+        is_isolated = (
+            self.options.isolation_level not in (None, 'read_committed')
+            or self.options.is_read_only
+        )
+        self.is_lazy = (is_lazy and not is_isolated) or not is_transactional
+        self.is_started = False
+        self.is_cancelled = False
+        self.connection = None
         self.worker = None
         self.worker_token = None
+        self.limiter = None
+        if is_diagnosed:
+            self.queries = QueryRecorder()
+
+    async def _limiter_open(self):
+        # the thread of the nested package is not counted, the outer one holds the token
+        if thread_limiter_var.get() is LIMITER_HELD or not (limiter := bulk_limiter_get()):
+            return
+        await bulk_limiter_acquire(limiter, self)
+        self.limiter = limiter
+        # the sub-requests in the dedicated thread do not take more tokens
+        self.limiter_token = thread_limiter_var.set(LIMITER_HELD)
+
+    def _limiter_close(self):
+        if self.limiter is not None:
+            thread_limiter_var.reset(self.limiter_token)
+            self.limiter.release_on_behalf_of(self)
+            self.limiter = self.limiter_token = None
+
+    def _worker_prepare(self):
+        # the connection of the dedicated thread: its queries are cancelled by the timeout
+        self.connection = connections[self.using]
+        self.connection.execute_wrappers.append(self._execute_guard)
+        if self.queries is not None:
+            self.connection.execute_wrappers.append(self.queries)
+
+    def _worker_release(self):
+        # the preparation is skipped if the enter is cancelled before the thread takes it
+        if self.connection is None:
+            return
+        for wrapper in (self._execute_guard, self.queries):
+            if wrapper is not None and wrapper in self.connection.execute_wrappers:
+                self.connection.execute_wrappers.remove(wrapper)
+
+    def _execute_guard(self, execute, sql, params, many, context):
+        # the cancelled sub-request does not start new queries
+        if self.is_cancelled:
+            raise BulkCancelledError
+        return execute(sql, params, many, context)
+
+    def _statement_cancel(self):
+        # called outside the dedicated thread, which is busy with the query
+        if self.connection is None or self.connection.vendor != 'postgresql':
+            return
+        if (pg_connection := self.connection.connection) is not None:
+            getattr(pg_connection, 'cancel_safe', pg_connection.cancel)()
 
     def _transaction_start(self):
         self.atomic.__enter__()
-
-    def _transaction_commit(self):
-        self.atomic.__exit__(None, None, None)
-
-    def _transaction_rollback(self, exc_type, exc_value, traceback):
-        self.atomic.__exit__(exc_type, exc_value, traceback)
+        # set in the thread, so that the transaction is ended even if the wait for the start
+        # is cancelled
+        self.is_started = True
+        self._transaction_configure()
+
+    def _transaction_configure(self):
+        connection = connections[self.using]
+        if connection.vendor != 'postgresql':
+            return
+
+        options = self.options
+        modes = []
+        if options.isolation_level:
+            modes.append(f'ISOLATION LEVEL {ISOLATION_LEVELS[options.isolation_level]}')
+        if options.is_read_only is not None:
+            modes.append('READ ONLY' if options.is_read_only else 'READ WRITE')
+
+        params = []
+        for name in TIMEOUTS:
+            if (value := getattr(options, name)) is not None:
+                params.extend((name, f'{value}ms'))
+
+        with connection.cursor() as cursor:
+            # must be the first statement of the transaction
+            if modes:
+                cursor.execute(f'SET TRANSACTION {", ".join(modes)}')
+            # the local values are reset at the end of the transaction, as with SET LOCAL
+            if params:
+                configs = ', '.join(['set_config(%s, %s, true)'] * (len(params) // 2))
+                cursor.execute(f'SELECT {configs}', params)
+
+    def _transaction_end(self, exc_type, exc_value, traceback):
+        # the lazy transaction may not be started if the package does not change the data
+        if self.is_started:
+            self.atomic.__exit__(exc_type, exc_value, traceback)
 
     def _transaction_clean_rollback(self):
         if transaction.get_rollback():
             self.atomic.__exit__(*sys.exc_info())
             self.atomic.__enter__()
+            # the new transaction gets the same isolation level and timeouts
+            self._transaction_configure()
+            return True
+        return False
 
     async def _task_push(self, func, *args):
         if self.worker:
             future: asyncio.Future = asyncio.Future()
             context = copy_context()
             self.worker.queue.put_nowait((context, func, args, future, None))
-            await future
+            return await future
+
+    async def begin(self):
+        """
+        Starts the transaction in the dedicated thread if it is not started yet
+        """
+        if not self.is_started:
+            await self._task_push(self._transaction_start)
+
+    async def item_enter(self, method: str):
+        if self.is_transactional and method not in SAFE_METHODS:
+            await self.begin()
+
+    async def cancel(self):
+        """
+        Cancels the sub-request running in the dedicated thread: the running query is cancelled
+        on the database server and the next queries are not started
+        """
+        self.is_cancelled = True
+        await asyncio.get_running_loop().run_in_executor(None, self._statement_cancel)
+
+    def _cancel_reset(self):
+        self.is_cancelled = False
+
+    async def cancel_reset(self):
+        # the dedicated thread finishes the cancelled sub-request before the flag is reset
+        await self._task_push(self._cancel_reset)
+
+    async def run(self, func, *args):
+        """
+        Executes the function in the transaction of the dedicated thread
+        """
+        await self.begin()
+        return await self._task_push(func, *args)
 
     async def check(self):
-        await self._task_push(self._transaction_clean_rollback)
+        # the values cached before the rollback may be based on the rolled back data
+        if self.is_started and await self._task_push(self._transaction_clean_rollback):
+            self.cache.clear()
 
     async def __aenter__(self):
+        await self._limiter_open()
+        threadpool_patch()
+        self._cache_open()
         current_async_library_cvar.set('asyncio')
 
         workers = _threadpool_workers.get()
@@ -179,15 +575,26 @@ class ThreadDedicated(ThreadsPool):
         self.worker.start()
         self.worker_token = worker_dedicated.set(self.worker)
 
-        await self._task_push(self._transaction_start)
+        try:
+            await self._task_push(self._worker_prepare)
+            if not self.is_lazy:
+                await self.begin()
+        except BaseException:
+            # the thread, the patch of the thread pool and the token of the limiter
+            # are not left behind, also when the enter is cancelled
+            await self.__aexit__(*sys.exc_info())
+            raise
         return self
 
     async def __aexit__(self, exc_type, exc_value, traceback):
-        if exc_type:
-            await self._task_push(self._transaction_rollback, exc_type, exc_value, traceback)
-        else:
-            await self._task_push(self._transaction_commit)
-
-        worker_dedicated.reset(self.worker_token)
-
-        self.worker.stop()
+        try:
+            # the transaction is ended in the thread, after its start if it is still pending
+            await self._task_push(self._transaction_end, exc_type, exc_value, traceback)
+        finally:
+            await self._task_push(self._worker_release)
+            worker_dedicated.reset(self.worker_token)
+
+            self.worker.stop()
+            self._cache_close()
+            threadpool_unpatch()
+            self._limiter_close()
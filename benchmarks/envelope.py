@@ -0,0 +1,128 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the bulk envelope encoding on large read packages.
+
+Compares the previous path (json.loads of every sub-response, response_model validation,
+jsonable_encoder and json.dumps of the envelope) with the direct bytes encoding.
+
+Run from the repository root:
+
+    python -m benchmarks.envelope
+"""
+
+import json
+import timeit
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+
+from pydantic import TypeAdapter
+
+from bazis.contrib.bulk.encoders import envelope_encode, item_encode
+from bazis.contrib.bulk.schemas import BulkResponseItemSchema
+
+
+HEADERS = [(b'content-type', b'application/vnd.api+json'), (b'content-length', b'1000')]
+
+# FastAPI builds the response field once per route
+RESPONSE_ADAPTER = TypeAdapter(list[BulkResponseItemSchema])
+
+
+def sub_response_build(size: int) -> bytes:
+    return json.dumps(
+        {
+            'data': [
+                {
+                    'id': str(uuid.uuid4()),
+                    'type': 'entity.parent_entity',
+                    'bs:action': 'view',
+                    'attributes': {
+                        'name': f'Parent {i}',
+                        'description': 'Description ' * 5,
+                        'is_active': True,
+                        'price': '845.42',
+                        'dt_approved': '2024-01-14T17:54:12Z',
+                    },
+                    'relationships': {
+                        'child_entities': {
+                            'data': [
+                                {'id': str(uuid.uuid4()), 'type': 'entity.child_entity'}
+                                for _ in range(3)
+                            ]
+                        }
+                    },
+                }
+                for i in range(size)
+            ],
+            'meta': {},
+        }
+    ).encode()
+
+
+def legacy_encode(bodies: list[bytes]) -> bytes:
+    results = [
+        {
+            'endpoint': '/api/v1/entity/parent_entity/',
+            'status': 200,
+            'headers': HEADERS,
+            'response': json.loads(body),
+        }
+        for body in bodies
+    ]
+    validated = RESPONSE_ADAPTER.validate_python(results)
+    return json.dumps(
+        jsonable_encoder(validated),
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+def direct_encode(bodies: list[bytes]) -> bytes:
+    return envelope_encode(
+        [
+            item_encode(
+                {
+                    'endpoint': '/api/v1/entity/parent_entity/',
+                    'status': 200,
+                    'headers': HEADERS,
+                    'response': body,
+                    'is_json': True,
+                }
+            )
+            for body in bodies
+        ]
+    )
+
+
+def main():
+    for items, size in ((10, 20), (100, 20), (500, 50)):
+        bodies = [sub_response_build(size) for _ in range(items)]
+        assert json.loads(legacy_encode(bodies)) == json.loads(direct_encode(bodies))
+
+        number = max(1, 200 // items)
+        legacy = min(timeit.repeat(lambda b=bodies: legacy_encode(b), number=number, repeat=3))
+        direct = min(timeit.repeat(lambda b=bodies: direct_encode(b), number=number, repeat=3))
+        print(
+            f'items={items:4} records={size:3}: '
+            f'legacy {legacy / number * 1000:8.2f} ms, '
+            f'direct {direct / number * 1000:8.2f} ms, '
+            f'speedup x{legacy / direct:.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark of the thread hops per package item.
+
+Compares dispatching the sub-requests through the application itself, `app.__call__` with
+its whole middleware stack, as the package did before, with the bulk middleware stack
+(the default settings).
+A thread hop is a call of a sync function in a worker thread: the dedicated thread in the
+transactional mode or the thread pool in the non-transactional mode.
+
+Requires the migrated database of the sample project. Run from the sample directory:
+
+    python ../benchmarks/thread_hops.py
+"""
+
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample.settings')
+
+from anyio._backends._asyncio import AsyncIOBackend  # noqa: E402
+from bazis_test_utils.utils import get_api_client  # noqa: E402
+from sample.main import app  # noqa: E402
+
+from bazis.contrib.bulk import executor  # noqa: E402
+
+
+ITEMS = 100
+
+SCENARIOS = {
+    'async route': {'endpoint': '/api/healthcheck', 'method': 'GET'},
+    'sync route': {'endpoint': '/api/v1/entity/child_entity/?page[limit]=1', 'method': 'GET'},
+}
+
+hops = 0
+run_sync_in_worker_thread = AsyncIOBackend.run_sync_in_worker_thread.__func__
+
+
+async def run_sync_in_worker_thread_counted(cls, *args, **kwargs):
+    global hops
+    hops += 1
+    return await run_sync_in_worker_thread(cls, *args, **kwargs)
+
+
+AsyncIOBackend.run_sync_in_worker_thread = classmethod(run_sync_in_worker_thread_counted)
+
+
+def measure(item: dict, is_atomic: bool) -> tuple[float, float]:
+    global hops
+    client = get_api_client(app)
+    # the package without items gives the hops of the package request itself
+    hops = 0
+    client.post(f'/api/v1/bulk/?is_atomic={str(is_atomic).lower()}', json_data=[])
+    hops_package = hops
+
+    hops = 0
+    dt_start = time.perf_counter()
+    response = client.post(
+        f'/api/v1/bulk/?is_atomic={str(is_atomic).lower()}', json_data=[item] * ITEMS
+    )
+    duration = time.perf_counter() - dt_start
+    assert response.status_code == 200, response.content
+    return (hops - hops_package) / ITEMS, duration / ITEMS * 1000
+
+
+def app_call_get(app):
+    # the sub-requests are dispatched the original way, through the whole application
+    return app.__call__
+
+
+def main():
+    app_bulk_get = executor.app_bulk_get
+
+    for name, item in SCENARIOS.items():
+        for is_atomic in (True, False):
+            executor.app_bulk_get = app_call_get
+            try:
+                before = measure(item, is_atomic)
+            finally:
+                executor.app_bulk_get = app_bulk_get
+            after = measure(item, is_atomic)
+            print(
+                f'{name:12} is_atomic={is_atomic!s:5}: '
+                f'before {before[0]:.1f} hops/item ({before[1]:.2f} ms/item), '
+                f'after {after[0]:.1f} hops/item ({after[1]:.2f} ms/item)'
+            )
+
+
+if __name__ == '__main__':
+    main()
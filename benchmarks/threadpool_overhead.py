@@ -0,0 +1,116 @@
+# Copyright 2026 EcoFuture Technology Services LLC and contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Microbenchmark of the overhead of the bulk thread pool integration on the other requests.
+
+Before, a middleware prepared the thread pool variables on every request of the application
+and the patched thread pool stayed installed, so every call of a sync function in a worker thread
+looked up the context variables of the dedicated thread. Now the thread pool is patched only
+while a package is executed. The benchmark compares:
+
+- the middleware layer per request: with the preparation of the thread pool variables and without
+- a call in a worker thread: with the patched thread pool (as before) and with the thread pool
+  of anyio (now, while no package is executed)
+
+Run from the sample directory:
+
+    python ../benchmarks/threadpool_overhead.py
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+
+sys.path.insert(0, os.getcwd())
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sample.settings')
+
+import django  # noqa: E402
+
+
+django.setup()
+
+from anyio import to_thread  # noqa: E402
+from anyio._backends._asyncio import _threadpool_idle_workers, _threadpool_workers  # noqa: E402
+
+from bazis.contrib.bulk.utils import (  # noqa: E402
+    IdleWorkersDeque,
+    threadpool_patch,
+    threadpool_unpatch,
+)
+
+
+REQUESTS = 100000
+CALLS = 20000
+
+
+def threadpool_vars_prepare():
+    """
+    The preparation that the removed middleware called on every request
+    """
+    try:
+        _threadpool_idle_workers.get()
+        _threadpool_workers.get()
+    except LookupError:
+        _threadpool_idle_workers.set(IdleWorkersDeque())
+        _threadpool_workers.set(set())
+
+
+async def app(scope, receive, send): ...
+
+
+async def app_prepared(scope, receive, send):
+    threadpool_vars_prepare()
+    await app(scope, receive, send)
+
+
+async def requests_measure(handler) -> float:
+    scope = {'type': 'http'}
+    time_start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await handler(scope, None, None)
+    return (time.perf_counter() - time_start) / REQUESTS * 10**9
+
+
+def noop(): ...
+
+
+async def calls_measure() -> float:
+    time_start = time.perf_counter()
+    for _ in range(CALLS):
+        await to_thread.run_sync(noop)
+    return (time.perf_counter() - time_start) / CALLS * 10**6
+
+
+async def main():
+    before = await requests_measure(app_prepared)
+    after = await requests_measure(app)
+    print(f'middleware per request: before {before:.0f} ns, after {after:.0f} ns')
+
+    # warm up the workers
+    await calls_measure()
+
+    threadpool_patch()
+    try:
+        before = await calls_measure()
+    finally:
+        threadpool_unpatch()
+    after = await calls_measure()
+    print(f'worker thread call:     before {before:.1f} us, after {after:.1f} us')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -12,10 +12,66 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import inspect
+import logging
+import os
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from types import SimpleNamespace
 from urllib.parse import urlencode
 
+from django.db import connection, transaction
+
+from fastapi import FastAPI, HTTPException
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
 import pytest
+from anyio import CapacityLimiter, to_thread
+from anyio._backends._asyncio import _threadpool_idle_workers
 from bazis_test_utils.utils import get_api_client
+from entity.models import ChildEntity
+
+from bazis.contrib.bulk import auth, executor, processes, routes
+from bazis.contrib.bulk.auth import (
+    BULK_IDENTITY,
+    BulkIdentity,
+    identity_from_scope,
+    identity_overrides_install,
+)
+from bazis.contrib.bulk.cache import bulk_cached
+from bazis.contrib.bulk.costs import cost_budget, cost_model, items_cost
+from bazis.contrib.bulk.diagnostics import sql_normalize
+from bazis.contrib.bulk.encoders import item_encode, json_dumps, json_loads
+from bazis.contrib.bulk.executor import BulkPackage, disconnect_watch, item_dispatch, sender_make
+from bazis.contrib.bulk.headers import headers_encode, headers_merge
+from bazis.contrib.bulk.idempotency import PackageIdempotency
+from bazis.contrib.bulk.imports import rows_ndjson
+from bazis.contrib.bulk.lanes import bulk_lanes, lane_select
+from bazis.contrib.bulk.metrics import bulk_metrics
+from bazis.contrib.bulk.preflight import preflight_is_enabled
+from bazis.contrib.bulk.processes import (
+    items_shard_execute,
+    package_is_sharded,
+    process_pool_reset,
+    receive_empty,
+    shard_run,
+)
+from bazis.contrib.bulk.results import BulkResults
+from bazis.contrib.bulk.scheduler import bulk_scheduler
+from bazis.contrib.bulk.schemas import BulkRequestItemSchema, BulkTransactionSchema
+from bazis.contrib.bulk.utils import (
+    ContextLimiter,
+    ThreadDedicated,
+    ThreadsPool,
+    bulk_threads_stats,
+    threadpool_patch,
+    threadpool_unpatch,
+    transaction_options_resolve,
+)
 
 from tests import factories
 
@@ -444,17 +500,13 @@ def test_bulk_update_rollback(sample_app):
 
     bulk_data = bulk_response.json()
 
-    # parent entity test case
+    # the package is rejected by the pre-flight validation, the valid items are not executed
 
     parent_entity_response = bulk_data[0]
 
-    assert parent_entity_response['status'] == 200
+    assert parent_entity_response['status'] == 424
     assert parent_entity_response['endpoint'] == request_data[0]['endpoint']
-
-    data = parent_entity_response['response']
-
-    it = data['data']
-    assert it['attributes']['name'] == 'New parent test name'
+    assert parent_entity_response['response'] is None
 
     # child entity test case
 
@@ -473,14 +525,9 @@ def test_bulk_update_rollback(sample_app):
     assert err['source']['pointer'] == '/attributes/child_price'
 
     child_entity_2_response = bulk_data[2]
-    assert child_entity_2_response['status'] == 201
+    assert child_entity_2_response['status'] == 424
     assert child_entity_2_response['endpoint'] == request_data[2]['endpoint']
-
-    data = child_entity_2_response['response']
-
-    it = data['data']
-    assert it['attributes']['child_name'] == 'Child test name 4'
-    assert it['relationships']['parent_entities']['data'][0]['id'] == str(parent_entity.pk)
+    assert child_entity_2_response['response'] is None
 
     # check that nothing was changed because of the error in the second request
 
@@ -565,3 +612,1461 @@ def test_bulk_update_rollback(sample_app):
 
     assert parent_entity.dependent_entities.count() == 2
     assert parent_entity.child_entities.count() == 4
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_envelope(sample_app):
+    factories.ChildEntityFactory.create_batch(3)
+
+    request_data = [
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'method': 'GET',
+        },
+        {
+            'endpoint': '/api/v1/entity/child_entity/?page[limit]=1',
+            'method': 'GET',
+        },
+    ]
+
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+
+    assert bulk_response.status_code == 200
+    assert bulk_response.headers['content-type'] == 'application/json'
+
+    bulk_data = bulk_response.json()
+
+    assert [it['endpoint'] for it in bulk_data] == [it['endpoint'] for it in request_data]
+    assert len(bulk_data[0]['response']['data']) == 3
+    assert len(bulk_data[1]['response']['data']) == 1
+
+    for it in bulk_data:
+        assert it['status'] == 200
+        headers = dict(it['headers'])
+        assert 'json' in headers['content-type']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_conditional(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+
+    # the ETag is calculated for the items sent with the conditional headers only
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/',
+        json_data=[
+            {'endpoint': endpoint, 'method': 'GET'},
+            {'endpoint': endpoint, 'method': 'GET', 'headers': [['If-None-Match', '""']]},
+        ],
+    )
+    assert bulk_response.status_code == 200
+
+    item_response, item_conditional = bulk_response.json()
+    assert item_response['status'] == 200
+    assert 'etag' not in dict(item_response['headers'])
+    assert item_conditional['status'] == 200
+    etag = dict(item_conditional['headers'])['etag']
+
+    # the resource is unchanged - the body is not returned
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/',
+        json_data=[
+            {'endpoint': endpoint, 'method': 'GET', 'headers': [['If-None-Match', etag]]},
+            {'endpoint': endpoint, 'method': 'GET', 'headers': [['If-None-Match', '"other"']]},
+        ],
+    )
+    assert bulk_response.status_code == 200
+
+    bulk_data = bulk_response.json()
+    assert bulk_data[0]['status'] == 304
+    assert bulk_data[0]['response'] is None
+    assert dict(bulk_data[0]['headers'])['etag'] == etag
+    assert bulk_data[1]['status'] == 200
+    assert bulk_data[1]['response']['data']['id'] == str(child_entity.pk)
+
+    # the resource is changed - the new body is returned
+    child_entity.child_name = 'New child test name'
+    child_entity.save()
+
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/',
+        json_data=[{'endpoint': endpoint, 'method': 'GET', 'headers': [['If-None-Match', etag]]}],
+    )
+    item_response = bulk_response.json()[0]
+    assert item_response['status'] == 200
+    assert item_response['response']['data']['attributes']['child_name'] == 'New child test name'
+    assert dict(item_response['headers'])['etag'] != etag
+
+
+def test_bulk_cache():
+    calls = []
+
+    @bulk_cached
+    def perms_get(user_id):
+        calls.append(user_id)
+        return {'view', 'change'}
+
+    async def run():
+        async with ThreadsPool():
+            assert perms_get(1) == {'view', 'change'}
+            # the sub-requests of the package share the cache in the worker threads
+            assert await run_in_threadpool(perms_get, 1) == {'view', 'change'}
+            perms_get(2)
+        # the cache is torn down with the package
+        perms_get(1)
+
+    asyncio.run(run())
+
+    assert calls == [1, 2, 1]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('thread_behavior', [ThreadsPool, ThreadDedicated])
+def test_bulk_cache_write(thread_behavior):
+    calls = []
+
+    @bulk_cached
+    def name_get(pk):
+        calls.append(pk)
+        return len(calls)
+
+    async def run():
+        async with thread_behavior() as thread:
+            # read -> write -> read: the value cached before the write is calculated again
+            for method in ('GET', 'GET', 'PATCH', 'GET', 'GET'):
+                await thread.item_enter(method)
+                name_get(1)
+                await thread.item_exit(method)
+
+    asyncio.run(run())
+
+    assert calls == [1, 1]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('is_atomic', ['true', 'false'])
+def test_bulk_async_route(sample_app, is_atomic):
+    child_entity = factories.ChildEntityFactory.create()
+
+    request_data = [
+        {'endpoint': '/api/healthcheck', 'method': 'GET'},
+        {'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/', 'method': 'GET'},
+        {'endpoint': '/api/healthcheck', 'method': 'GET'},
+    ]
+
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/?is_atomic={is_atomic}', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+
+    bulk_data = bulk_response.json()
+    assert [it['status'] for it in bulk_data] == [200, 200, 200]
+    assert bulk_data[0]['response'] == ''
+    assert bulk_data[1]['response']['data']['id'] == str(child_entity.pk)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_bulk_prefetch(sample_app, settings, prefetch):
+    settings.BAZIS_BULK_PREFETCH = prefetch
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+    request_data = []
+    for i in range(10):
+        request_data.append(
+            {
+                'endpoint': endpoint,
+                'method': 'PATCH',
+                'body': {
+                    'data': {
+                        'id': str(child_entity.pk),
+                        'type': 'entity.child_entity',
+                        'bs:action': 'change',
+                        'attributes': {'child_name': f'Child test name {i}'},
+                    },
+                },
+            }
+        )
+        request_data.append({'endpoint': f'{endpoint}?step={i}', 'method': 'GET'})
+
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 200
+
+    # the items are executed one after another in the order of the package
+    bulk_data = bulk_response.json()
+    assert [it['endpoint'] for it in bulk_data] == [it['endpoint'] for it in request_data]
+    for i in range(10):
+        assert bulk_data[i * 2 + 1]['status'] == 200
+        data = bulk_data[i * 2 + 1]['response']['data']
+        assert data['attributes']['child_name'] == f'Child test name {i}'
+
+    child_entity.refresh_from_db()
+    assert child_entity.child_name == 'Child test name 9'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_preflight(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    request_data = [
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'PATCH',
+            'body': {
+                'data': {
+                    'id': str(child_entity.pk),
+                    'type': 'entity.child_entity',
+                    'bs:action': 'change',
+                    'attributes': {'child_name': 'New child test name'},
+                },
+            },
+        },
+        {'endpoint': '/api/v1/entity/unknown_entity/', 'method': 'GET'},
+        {'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/', 'method': 'PUT'},
+    ]
+
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?is_atomic=true', json_data=request_data
+    )
+    assert bulk_response.status_code == 400
+
+    bulk_data = bulk_response.json()
+    assert [it['status'] for it in bulk_data] == [424, 404, 405]
+    assert bulk_data[0]['response'] is None
+
+    child_entity.refresh_from_db()
+    assert child_entity.child_name == 'Child test name'
+
+    # the non-transactional mode executes the valid items
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?is_atomic=false', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+    assert [it['status'] for it in bulk_response.json()] == [200, 404, 405]
+
+    child_entity.refresh_from_db()
+    assert child_entity.child_name == 'New child test name'
+
+    # the bodies of a batch are validated against its route
+    request_data = [
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'method': 'POST',
+            'bodies': [
+                {
+                    'data': {
+                        'type': 'entity.child_entity',
+                        'bs:action': 'add',
+                        'attributes': {'child_name': 'Batch child name'},
+                    },
+                },
+                {'wrong': 'body'},
+            ],
+        },
+    ]
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 400
+    assert [it['status'] for it in bulk_response.json()[0]['results']] == [424, 422]
+    assert not ChildEntity.objects.filter(child_name='Batch child name').exists()
+
+    # a request without a valid token is not validated, its routes answer with the auth error
+    assert preflight_is_enabled(None)
+    assert preflight_is_enabled(BulkIdentity(token_data={}, user=SimpleNamespace(pk=1)))
+    assert not preflight_is_enabled(BulkIdentity(error=ValueError('invalid token')))
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('is_snapshot', ['true', 'false'])
+def test_bulk_read_only(sample_app, is_snapshot):
+    child_entities = factories.ChildEntityFactory.create_batch(3)
+
+    request_data = [
+        {'endpoint': f'/api/v1/entity/child_entity/{it.pk}/', 'method': 'GET'}
+        for it in child_entities
+    ]
+
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/?is_snapshot={is_snapshot}', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+
+    bulk_data = bulk_response.json()
+    assert [it['status'] for it in bulk_data] == [200, 200, 200]
+    assert [it['response']['data']['id'] for it in bulk_data] == [
+        str(it.pk) for it in child_entities
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_lazy_transaction(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+
+    request_data = [
+        {'endpoint': endpoint, 'method': 'GET'},
+        {
+            'endpoint': endpoint,
+            'method': 'PATCH',
+            'body': {
+                'data': {
+                    'id': str(child_entity.pk),
+                    'type': 'entity.child_entity',
+                    'bs:action': 'change',
+                    'attributes': {'child_name': 'New child test name'},
+                },
+            },
+        },
+        {'endpoint': f'/api/v1/entity/child_entity/{uuid.uuid4()}/', 'method': 'GET'},
+    ]
+
+    # the read before the transaction, the change and the failed read after it
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 400
+
+    bulk_data = bulk_response.json()
+    assert bulk_data[0]['status'] == 200
+    assert bulk_data[0]['response']['data']['attributes']['child_name'] == 'Child test name'
+    assert bulk_data[1]['status'] == 200
+    assert bulk_data[2]['status'] == 404
+
+    # the change is rolled back
+    child_entity.refresh_from_db()
+    assert child_entity.child_name == 'Child test name'
+
+
+def test_bulk_transaction_options(settings):
+    settings.BAZIS_BULK_ISOLATION_LEVEL = 'repeatable_read'
+    settings.BAZIS_BULK_LOCK_TIMEOUT = 5000
+    settings.BAZIS_BULK_LOCK_TIMEOUT_MAX = 10000
+    settings.BAZIS_BULK_STATEMENT_TIMEOUT = None
+    settings.BAZIS_BULK_STATEMENT_TIMEOUT_MAX = 30000
+    settings.BAZIS_BULK_IDLE_TIMEOUT = None
+    settings.BAZIS_BULK_IDLE_TIMEOUT_MAX = None
+
+    # the defaults and the maximums of the settings
+    options = transaction_options_resolve(None)
+    assert options.isolation_level == 'repeatable_read'
+    assert options.lock_timeout == 5000
+    assert options.statement_timeout == 30000
+    assert options.idle_in_transaction_session_timeout is None
+
+    # the values of the package are limited by the maximums
+    options = transaction_options_resolve(
+        BulkTransactionSchema(
+            isolation_level='serializable',
+            lock_timeout=60000,
+            statement_timeout=1000,
+            idle_in_transaction_session_timeout=2000,
+        )
+    )
+    assert options.isolation_level == 'serializable'
+    assert options.lock_timeout == 10000
+    assert options.statement_timeout == 1000
+    assert options.idle_in_transaction_session_timeout == 2000
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_transaction_options_apply(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    request_data = [
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'PATCH',
+            'body': {
+                'data': {
+                    'id': str(child_entity.pk),
+                    'type': 'entity.child_entity',
+                    'bs:action': 'change',
+                    'attributes': {'child_name': 'New child test name'},
+                },
+            },
+        },
+    ]
+
+    query = urlencode(
+        {
+            'isolation_level': 'serializable',
+            'lock_timeout': 1000,
+            'statement_timeout': 10000,
+            'idle_in_transaction_session_timeout': 10000,
+        }
+    )
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/?{query}', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+    assert bulk_response.json()[0]['status'] == 200
+
+    child_entity.refresh_from_db()
+    assert child_entity.child_name == 'New child test name'
+
+    # unknown isolation level
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?isolation_level=chaos', json_data=request_data
+    )
+    assert bulk_response.status_code == 422
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_transaction_options_restart():
+    options = BulkTransactionSchema(isolation_level='serializable', statement_timeout=10000)
+
+    # the reads before the first write are executed in the transaction of the isolation level
+    assert not ThreadDedicated(is_lazy=True, options=options).is_lazy
+    assert ThreadDedicated(
+        is_lazy=True, options=BulkTransactionSchema(isolation_level='read_committed')
+    ).is_lazy
+
+    def transaction_settings():
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW statement_timeout')
+            statement_timeout = cursor.fetchone()[0]
+            cursor.execute('SHOW transaction_isolation')
+            return statement_timeout, cursor.fetchone()[0]
+
+    async def run():
+        async with ThreadDedicated(options=options) as thread:
+            # the failed item marks the transaction for the rollback, it is restarted
+            await thread.run(transaction.set_rollback, True)
+            await thread.check()
+            return await thread.run(transaction_settings)
+
+    assert asyncio.run(run()) == ('10s', 'serializable')
+
+
+class SerializationFailureError(Exception):
+    sqlstate = '40001'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_retry(sample_app, settings, monkeypatch):
+    settings.BAZIS_BULK_RETRY_DELAY = 0
+
+    items_run = executor.items_run
+    attempts = []
+    failures = [2]
+
+    async def items_run_conflict(package, thread, results):
+        # the attempts fail with a conflict with a concurrent transaction inside their transaction:
+        # the first one before its statements, the second one after them, before the commit
+        attempts.append(failures[0])
+        if failures[0] == 2:
+            failures[0] -= 1
+            raise RuntimeError('could not serialize access') from SerializationFailureError()
+        status_code = await items_run(package, thread, results)
+        if failures[0]:
+            failures[0] -= 1
+            raise RuntimeError('could not serialize access') from SerializationFailureError()
+        return status_code
+
+    monkeypatch.setattr(executor, 'items_run', items_run_conflict)
+
+    request_data = [
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'method': 'POST',
+            'body': {
+                'data': {
+                    'type': 'entity.child_entity',
+                    'bs:action': 'add',
+                    'attributes': {'child_name': 'Retried child name'},
+                },
+            },
+        },
+    ]
+
+    retries = bulk_metrics.snapshot().get('retries', 0)
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?retries=3', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+    assert bulk_response.headers['X-Bulk-Retries'] == '2'
+    assert bulk_response.json()[0]['status'] == 201
+    assert bulk_metrics.snapshot()['retries'] == retries + 2
+    assert attempts == [2, 1, 0]
+
+    # the failed attempts are rolled back, the package is written once
+    assert ChildEntity.objects.filter(child_name='Retried child name').count() == 1
+
+    # the retries are exhausted, nothing is written
+    failures[0] = 2
+    request_data[0]['body']['data']['attributes']['child_name'] = 'Exhausted child name'
+    with pytest.raises(RuntimeError):
+        get_api_client(sample_app).post('/api/v1/bulk/?retries=1', json_data=request_data)
+    assert not ChildEntity.objects.filter(child_name='Exhausted child name').exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_idempotency(sample_app, settings, monkeypatch):
+    # the keys are separated by the users
+    async def identity_resolve(request):
+        return BulkIdentity(token_data={}, user=SimpleNamespace(pk=1))
+
+    monkeypatch.setattr(routes, 'identity_resolve', identity_resolve)
+
+    parent_entity = factories.ParentEntityFactory.create(
+        child_entities=False, dependent_entities=None, extended_entity=None
+    )
+
+    request_data = [
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'method': 'POST',
+            'body': {
+                'data': {
+                    'type': 'entity.child_entity',
+                    'bs:action': 'add',
+                    'attributes': {
+                        'child_name': 'Child test name',
+                        'child_description': 'Child test description',
+                        'child_is_active': True,
+                        'child_price': '421.74',
+                        'child_dt_approved': '2024-01-14T17:54:12Z',
+                    },
+                    'relationships': {
+                        'parent_entities': {
+                            'data': [{'id': str(parent_entity.pk), 'type': 'entity.parent_entity'}],
+                        },
+                    },
+                },
+            },
+        },
+    ]
+
+    client = get_api_client(sample_app)
+    headers = {'Idempotency-Key': 'key-1'}
+
+    bulk_response = client.post('/api/v1/bulk/', json_data=request_data, headers=headers)
+    assert bulk_response.status_code == 200
+    assert 'Idempotency-Replayed' not in bulk_response.headers
+    assert parent_entity.child_entities.count() == 1
+
+    # the retry gets the stored result without executing the package again
+    bulk_response_retry = client.post('/api/v1/bulk/', json_data=request_data, headers=headers)
+    assert bulk_response_retry.status_code == 200
+    assert bulk_response_retry.headers['Idempotency-Replayed'] == 'true'
+    assert bulk_response_retry.content == bulk_response.content
+    assert parent_entity.child_entities.count() == 1
+
+    # the key cannot be reused with a different package
+    request_data[0]['body']['data']['attributes']['child_name'] = 'Child test name 2'
+    bulk_response = client.post('/api/v1/bulk/', json_data=request_data, headers=headers)
+    assert bulk_response.status_code == 422
+
+    # the key is required to be used in the transactional mode
+    bulk_response = client.post(
+        '/api/v1/bulk/?is_atomic=false',
+        json_data=request_data,
+        headers={'Idempotency-Key': 'key-2'},
+    )
+    assert bulk_response.status_code == 400
+
+    # the snapshot of the transaction would not see the result of the concurrent package
+    bulk_response = client.post(
+        '/api/v1/bulk/?isolation_level=serializable',
+        json_data=request_data,
+        headers={'Idempotency-Key': 'key-2'},
+    )
+    assert bulk_response.status_code == 400
+
+    # the large result is not stored, its duplicate is rejected instead of replayed
+    settings.BAZIS_BULK_SPOOL_SIZE = 16
+    headers = {'Idempotency-Key': 'key-3'}
+    bulk_response = client.post('/api/v1/bulk/', json_data=request_data, headers=headers)
+    assert bulk_response.status_code == 200
+    bulk_response = client.post('/api/v1/bulk/', json_data=request_data, headers=headers)
+    assert bulk_response.status_code == 409
+    assert parent_entity.child_entities.count() == 2
+
+    # without the advisory lock, the concurrent duplicate fails on the unique key
+    idempotency = PackageIdempotency('key-4', '1', 'fingerprint')
+    idempotency._store('default', b'[]', 200)
+    with pytest.raises(HTTPException) as exc_info:
+        idempotency._store('default', b'[]', 200)
+    assert exc_info.value.status_code == 409
+
+    # the anonymous clients cannot use the keys, the clients behind a proxy would share them
+    monkeypatch.undo()
+    bulk_response = client.post(
+        '/api/v1/bulk/', json_data=request_data, headers={'Idempotency-Key': 'key-5'}
+    )
+    assert bulk_response.status_code == 401
+
+
+def test_bulk_disconnect_watch():
+    async def run():
+        messages = asyncio.Queue()
+
+        class RequestStub:
+            scope = {}
+            receive = messages.get
+
+        async with disconnect_watch(RequestStub()) as disconnected:
+            await messages.put({'type': 'http.request', 'body': b'', 'more_body': False})
+            await asyncio.sleep(0.01)
+            assert not disconnected.is_set()
+
+            await messages.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(disconnected.wait(), 1)
+
+    asyncio.run(run())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_nested(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+
+    # the receive of the nested package returns its body again, it is not watched
+    request_data = [
+        {
+            'endpoint': '/api/v1/bulk/?is_atomic=false',
+            'method': 'POST',
+            'body': [{'endpoint': endpoint, 'method': 'GET'}],
+        },
+    ]
+
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?is_atomic=false', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+
+    nested_response = bulk_response.json()[0]
+    assert nested_response['status'] == 200
+    assert nested_response['response'][0]['status'] == 200
+    assert (
+        nested_response['response'][0]['response']['data']['attributes']['child_name']
+        == 'Child test name'
+    )
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('is_atomic', ['true', 'false'])
+def test_bulk_deadline(sample_app, monkeypatch, is_atomic):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    item_dispatch_original = executor.item_dispatch
+
+    async def item_dispatch_slow(*args, **kwargs):
+        # the first item exhausts the deadline of the package
+        result = await item_dispatch_original(*args, **kwargs)
+        await asyncio.sleep(0.2)
+        return result
+
+    monkeypatch.setattr(executor, 'item_dispatch', item_dispatch_slow)
+
+    request_data = [
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'PATCH',
+            'body': {
+                'data': {
+                    'id': str(child_entity.pk),
+                    'type': 'entity.child_entity',
+                    'bs:action': 'change',
+                    'attributes': {'child_name': 'New child test name'},
+                },
+            },
+        },
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'GET',
+        },
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'GET',
+        },
+    ]
+
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/?is_atomic={is_atomic}&deadline_ms=150', json_data=request_data
+    )
+    data = bulk_response.json()
+    assert [it['status'] for it in data] == [200, 504, 504]
+
+    child_entity.refresh_from_db()
+    if is_atomic == 'true':
+        # the atomic package is rolled back
+        assert bulk_response.status_code == 504
+        assert child_entity.child_name == 'Child test name'
+    else:
+        assert bulk_response.status_code == 200
+        assert child_entity.child_name == 'New child test name'
+
+
+def test_bulk_item_timeout():
+    class ThreadStub(ThreadsPool):
+        def __init__(self):
+            self.calls = []
+
+        async def cancel(self):
+            self.calls.append('cancel')
+
+        async def cancel_reset(self):
+            self.calls.append('cancel_reset')
+
+    class PreparedStub:
+        scope = {}
+        receive = None
+
+    def app_make(delay):
+        async def app(scope, receive, send):
+            await asyncio.sleep(delay)
+
+        return app
+
+    async def run():
+        thread = ThreadStub()
+        assert await item_dispatch(app_make(0), PreparedStub(), {}, thread, 1)
+        assert thread.calls == []
+
+        # the sub-request that is not completed within the timeout is cancelled
+        assert not await item_dispatch(app_make(10), PreparedStub(), {}, thread, 0.05)
+        assert thread.calls == ['cancel', 'cancel_reset']
+
+    asyncio.run(run())
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('spool_size', [1024, 8 * 1024 * 1024])
+@pytest.mark.parametrize('buffer_size', [16, 1024 * 1024])
+def test_bulk_spool(sample_app, settings, spool_size, buffer_size):
+    settings.BAZIS_BULK_SPOOL_SIZE = spool_size
+    settings.BAZIS_BULK_ITEM_BUFFER_SIZE = buffer_size
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+    request_data = [{'endpoint': f'{endpoint}?step={i}', 'method': 'GET'} for i in range(20)]
+
+    # the large results are spilled to disk and streamed back from it
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 200
+    assert bulk_response.headers['Content-Length'] == str(len(bulk_response.content))
+
+    bulk_data = bulk_response.json()
+    assert [it['endpoint'] for it in bulk_data] == [it['endpoint'] for it in request_data]
+    for it in bulk_data:
+        assert it['status'] == 200
+        assert it['response']['data']['attributes']['child_name'] == 'Child test name'
+
+
+def test_bulk_results():
+    results = BulkResults(spool_size=16)
+    assert results.getvalue() == b'[]'
+    results.close()
+
+    results = BulkResults(spool_size=16)
+    results.extend([b'{"status":200}', b'{"status":201}'])
+    assert len(results) == 2
+    assert results.is_spilled
+
+    async def run():
+        return b''.join([chunk async for chunk in results.stream()])
+
+    assert asyncio.run(run()) == b'[{"status":200},{"status":201}]'
+    assert results.file.closed
+
+
+@pytest.mark.parametrize('buffer_size', [None, 4])
+@pytest.mark.parametrize(
+    'content_type, chunks, response',
+    [
+        (b'application/json', [b'{"name":', b'"\xd0', b'\xb9"}'], {'name': '\u0439'}),
+        (b'text/plain', [b'chunk \xd0', b'\xb9 ', b'last'], 'chunk \u0439 last'),
+    ],
+)
+def test_bulk_sender(buffer_size, content_type, chunks, response):
+    result = {'endpoint': '/api/v1/entity/child_entity/'}
+    sender = sender_make(result, buffer_size)
+
+    async def run():
+        await sender(
+            {
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', content_type)],
+            }
+        )
+        for i, chunk in enumerate(chunks):
+            await sender(
+                {'type': 'http.response.body', 'body': chunk, 'more_body': i < len(chunks) - 1}
+            )
+
+    asyncio.run(run())
+
+    # all the chunks are collected, the large body is spilled to a temporary file
+    assert isinstance(result['response'], bytearray) == (buffer_size is None)
+    assert json_loads(item_encode(result))['response'] == response
+
+
+def test_bulk_json_dumps():
+    # the integers orjson can not serialize fall back to the standard library
+    data = {'id': 2**70, 'name': '\u0439'}
+    assert json_loads(json_dumps(data)) == data
+
+
+def test_bulk_json_loads():
+    # the integers above 64 bits are not turned into floats, such as the identifiers of the rows
+    async def stream():
+        yield b'{"id": 18446744073709551617, "amount": -18446744073709551617}\n'
+
+    async def run():
+        return [row async for row in rows_ndjson(stream())]
+
+    assert asyncio.run(run()) == [{'id': 2**64 + 1, 'amount': -(2**64 + 1)}]
+    assert json_loads('[18446744073709551617]') == [2**64 + 1]
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('is_atomic', ['true', 'false'])
+def test_bulk_import_csv(sample_app, is_atomic):
+    content = (
+        'name,price\r\n'
+        'Import 1,10.00\r\n'
+        '"Import 2, quoted",20.00\r\n'
+        'Import 3,wrong price\r\n'
+        'Import 4,40.00\r\n'
+        'Import 5,50.00\r\n'
+    )
+    params = urlencode(
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'resource_type': 'entity.child_entity',
+            'mapping': '{"name": "child_name", "price": "child_price"}',
+            'batch_size': 2,
+            'is_atomic': is_atomic,
+        }
+    )
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/import/?{params}',
+        content=content.encode(),
+        headers={'Content-Type': 'text/csv'},
+    )
+    bulk_data = bulk_response.json()
+    names = set(ChildEntity.objects.values_list('child_name', flat=True))
+
+    if is_atomic == 'true':
+        # the import is stopped by the failed batch and rolled back
+        assert bulk_response.status_code == 400
+        assert bulk_response.headers['X-Bulk-Batches'] == '2'
+        assert [it['status'] for it in bulk_data] == [201, 201, 422, 201]
+        assert names == set()
+    else:
+        # only the failed batch is rolled back
+        assert bulk_response.status_code == 200
+        assert bulk_response.headers['X-Bulk-Batches'] == '3'
+        assert bulk_response.headers['X-Bulk-Batches-Failed'] == '1'
+        assert [it['status'] for it in bulk_data] == [201, 201, 422, 201, 201]
+        assert names == {'Import 1', 'Import 2, quoted', 'Import 5'}
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_import_ndjson(sample_app):
+    content = b'{"child_name": "Import 1"}\n\n{"child_name": "Import 2", "child_price": "2.50"}\n'
+    params = urlencode(
+        {'endpoint': '/api/v1/entity/child_entity/', 'resource_type': 'entity.child_entity'}
+    )
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/import/?{params}',
+        content=content,
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    assert bulk_response.status_code == 200
+    assert [it['status'] for it in bulk_response.json()] == [201, 201]
+    assert set(ChildEntity.objects.values_list('child_name', flat=True)) == {'Import 1', 'Import 2'}
+
+    # the file of an unknown format is rejected
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/import/?{params}', content=content, headers={'Content-Type': 'text/plain'}
+    )
+    assert bulk_response.status_code == 415
+
+    # the malformed row stops the non-atomic import, the rows before it stay committed
+    content = (
+        b'{"child_name": "Import 3"}\n{"child_name": "Import 4"}\n'
+        b'{"child_name": "Import 5"}\nnot a row\n{"child_name": "Import 6"}\n'
+    )
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/import/?{params}&is_atomic=false&batch_size=2',
+        content=content,
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    assert bulk_response.status_code == 200
+    assert [it['status'] for it in bulk_response.json()] == [201, 201, 201, 400]
+    assert bulk_response.headers['X-Bulk-Batches'] == '3'
+    assert bulk_response.headers['X-Bulk-Batches-Failed'] == '1'
+    assert ChildEntity.objects.filter(child_name__in=['Import 5', 'Import 6']).count() == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_batch(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+
+    request_data = [
+        {
+            'endpoint': '/api/v1/entity/child_entity/',
+            'method': 'POST',
+            'bodies': [
+                {
+                    'data': {
+                        'type': 'entity.child_entity',
+                        'bs:action': 'add',
+                        'attributes': {'child_name': f'Batch name {i}'},
+                    },
+                }
+                for i in range(3)
+            ],
+        },
+        {
+            'endpoint': f'/api/v1/entity/child_entity/{child_entity.pk}/',
+            'method': 'GET',
+        },
+    ]
+
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 200
+
+    # the results of the batch are returned in a compact array in the order of the bodies
+    bulk_data = bulk_response.json()
+    assert len(bulk_data) == 2
+    assert bulk_data[0]['endpoint'] == '/api/v1/entity/child_entity/'
+    assert [it['status'] for it in bulk_data[0]['results']] == [201, 201, 201]
+    assert [
+        it['response']['data']['attributes']['child_name'] for it in bulk_data[0]['results']
+    ] == [f'Batch name {i}' for i in range(3)]
+    assert 'endpoint' not in bulk_data[0]['results'][0]
+    assert bulk_data[1]['status'] == 200
+
+    assert ChildEntity.objects.filter(child_name__startswith='Batch name').count() == 3
+
+    # the invalid body of an atomic batch rejects the package before it is executed
+    request_data[0]['bodies'][1]['data']['attributes']['child_price'] = 'wrong price'
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 400
+    bulk_data = bulk_response.json()
+    assert [it['status'] for it in bulk_data[0]['results']] == [424, 422, 424]
+    assert bulk_data[1]['status'] == 424
+    assert ChildEntity.objects.filter(child_name__startswith='Batch name').count() == 3
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_cost(sample_app, settings):
+    settings.BAZIS_BULK_COST_WEIGHTS = {
+        'GET /api/v1/entity/child_entity/{item_id}/': 2.0,
+        'PATCH': 0.5,
+    }
+    settings.BAZIS_BULK_COST_UNIT = 10**9
+    settings.BAZIS_BULK_COST_USER_RATE = 0.001
+    settings.BAZIS_BULK_COST_USER_BURST = 5.0
+    settings.BAZIS_BULK_COST_WAIT = 0
+    cost_model.reset()
+    cost_budget.reset()
+
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+    endpoint = f'/api/v1/entity/child_entity/{child_entity.pk}/'
+    request_data = [
+        {'endpoint': endpoint, 'method': 'GET'},
+        {'endpoint': f'{endpoint}?include=parent_entities', 'method': 'GET'},
+        {'endpoint': '/api/v1/entity/child_entity/?page[limit]=100', 'method': 'GET'},
+    ]
+
+    # the weights of the routes, the included relations and the page size
+    items = [BulkRequestItemSchema(**it) for it in request_data]
+    page_factor = 100 / settings.BAZIS_API_PAGINATION_PAGE_SIZE_DEFAULT
+    assert items_cost(sample_app, items[:2]) == 2.0 + 2.0 * 1.5
+    assert items_cost(sample_app, items[2:]) == max(page_factor, 1)
+
+    # the package within the budget of the user is executed
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data[:1])
+    assert bulk_response.status_code == 200
+
+    # the budget is exhausted
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data[:2])
+    assert bulk_response.status_code == 429
+    assert int(bulk_response.headers['Retry-After']) > 0
+
+    # the package that never fits into the budget is not asked to retry
+    cost_budget.reset()
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/', json_data=[request_data[1]] * 3
+    )
+    assert bulk_response.status_code == 413
+    assert 'Retry-After' not in bulk_response.headers
+
+    # the batches of the import are charged too
+    cost_budget.reset()
+    settings.BAZIS_BULK_COST_WEIGHTS = {'POST': 6.0}
+    params = urlencode(
+        {'endpoint': '/api/v1/entity/child_entity/', 'resource_type': 'entity.child_entity'}
+    )
+    bulk_response = get_api_client(sample_app).post(
+        f'/api/v1/bulk/import/?{params}',
+        content=b'{"child_name": "Import cost"}\n',
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    assert bulk_response.status_code == 413
+    assert not ChildEntity.objects.filter(child_name='Import cost').exists()
+
+    cost_budget.reset()
+
+
+def test_bulk_scheduler(settings):
+    settings.BAZIS_BULK_SCHEDULER_SLOTS = 1
+    settings.BAZIS_BULK_SCHEDULER_SHARES = {'small': 2.0}
+    bulk_scheduler.reset()
+    bulk_metrics.reset()
+    order = []
+
+    async def package(tenant, count):
+        for _ in range(count):
+            async with bulk_scheduler.slot(tenant):
+                order.append(tenant)
+                await asyncio.sleep(0.001)
+
+    async def run():
+        large = asyncio.create_task(package('large', 8))
+        await asyncio.sleep(0.003)
+        await asyncio.gather(large, package('small', 3))
+
+    asyncio.run(run())
+
+    # the small package is not queued behind the whole large one
+    assert order.count('small') == 3
+    assert order[-1] == 'large'
+    assert bulk_scheduler.busy == 0
+    metrics = bulk_metrics.snapshot()
+    assert metrics['scheduler_wait:small_count'] == 3
+    assert metrics['scheduler_wait:large_count'] > 0
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_lanes(sample_app, settings):
+    settings.BAZIS_BULK_LANES = {'batch': 1}
+    settings.BAZIS_BULK_LANE_INTERACTIVE_ITEMS = 2
+    bulk_lanes.reset()
+    bulk_metrics.reset()
+
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+    item = BulkRequestItemSchema(
+        endpoint=f'/api/v1/entity/child_entity/{child_entity.pk}/', method='GET'
+    )
+    assert lane_select([item] * 2) == 'interactive'
+    assert lane_select([item] * 3) == 'batch'
+    assert lane_select([item], 'batch') == 'batch'
+    # the large package is not moved to the interactive lane
+    assert lane_select([item] * 3, 'interactive') == 'batch'
+
+    order = []
+
+    async def package(name, lane):
+        async with bulk_lanes.slot(lane):
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        batch = asyncio.create_task(package('batch', 'batch'))
+        await asyncio.sleep(0)
+        # the full lane of the large packages does not hold the interactive ones
+        await asyncio.gather(package('batch_next', 'batch'), package('interactive', 'interactive'))
+        await batch
+
+    asyncio.run(run())
+
+    assert order == ['batch', 'interactive', 'batch_next']
+    assert bulk_lanes.busy['batch'] == 0
+
+    # the additional work of a package, such as its groups, takes a free slot only
+    assert bulk_lanes.slot_try('batch')
+    assert not bulk_lanes.slot_try('batch')
+    bulk_lanes.slot_release('batch')
+    assert bulk_lanes.busy['batch'] == 0
+    assert bulk_metrics.snapshot()['lane_wait:batch_count'] == 1
+
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?lane=batch', json_data=[{'endpoint': item.endpoint, 'method': 'GET'}]
+    )
+    assert bulk_response.status_code == 200
+    assert bulk_metrics.snapshot()['packages_lane:batch'] == 1
+
+
+def test_bulk_threads(settings):
+    settings.BAZIS_BULK_THREADS = 1
+    bulk_metrics.reset()
+    stats = []
+
+    async def package():
+        async with ThreadsPool():
+            await run_in_threadpool(time.sleep, 0.02)
+
+    async def run():
+        tasks = [asyncio.create_task(package()) for _ in range(2)]
+        # the other requests do not wait for the tokens of the packages
+        await run_in_threadpool(time.sleep, 0)
+        stats.append(bulk_threads_stats())
+        await asyncio.gather(*tasks)
+        stats.append(bulk_threads_stats())
+        # without the packages, the thread pool of anyio is not patched
+        limiters.append(to_thread.current_default_thread_limiter())
+
+    limiters = []
+    asyncio.run(run())
+
+    assert stats[0] == {'threads_total': 1, 'threads_borrowed': 1, 'threads_waiting': 1}
+    assert stats[1]['threads_borrowed'] == 0
+    assert not isinstance(limiters[0], ContextLimiter)
+    assert bulk_metrics.snapshot()['threads_wait_count'] == 1
+
+
+def test_bulk_threadpool_patch():
+    def noop(): ...
+
+    def workers_check(deques):
+        # no worker is idle in two deques
+        workers = [worker for idle_workers in deques for worker in idle_workers]
+        assert len(workers) == len(set(workers))
+
+    async def run():
+        await to_thread.run_sync(noop)
+        deques = [_threadpool_idle_workers.get()]
+
+        # the call waiting for the limiter has read the deque of the idle workers
+        limiter = CapacityLimiter(1)
+        await limiter.acquire()
+        waiting = asyncio.create_task(to_thread.run_sync(noop, limiter=limiter))
+        await asyncio.sleep(0.01)
+
+        threadpool_patch()
+        deques.append(_threadpool_idle_workers.get())
+        threadpool_unpatch()
+        deques.append(_threadpool_idle_workers.get())
+        threadpool_patch()
+        deques.append(_threadpool_idle_workers.get())
+        workers_check(deques)
+        assert len(deques[-1]) == 1
+
+        # the waiting call and a new call do not take the same idle worker
+        limiter.release()
+        await asyncio.gather(waiting, to_thread.run_sync(noop))
+        threadpool_unpatch()
+        deques.append(_threadpool_idle_workers.get())
+        workers_check(deques)
+        assert len(deques[-1]) == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_processes(settings):
+    settings.BAZIS_BULK_PROCESSES = 2
+    settings.BAZIS_BULK_PROCESSES_ITEMS_MIN = 3
+
+    child_entities = factories.ChildEntityFactory.create_batch(3)
+    items = [
+        BulkRequestItemSchema(endpoint=f'/api/v1/entity/child_entity/{it.pk}/', method='GET')
+        for it in child_entities
+    ]
+
+    # only the large non-atomic packages of the reading items are sharded
+    assert package_is_sharded(items, is_atomic=False)
+    assert not package_is_sharded(items, is_atomic=True)
+    assert not package_is_sharded(items[:2], is_atomic=False)
+    assert not package_is_sharded(
+        [*items[:2], BulkRequestItemSchema(endpoint=items[0].endpoint, method='DELETE')],
+        is_atomic=False,
+    )
+
+    # the shard is executed by the worker the same way as by the package request
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('testclient', 50000),
+        'method': 'POST',
+        'path': '/api/v1/bulk/',
+        'query_string': b'is_atomic=false',
+        'headers': [(b'host', b'testserver')],
+    }
+    content, count = asyncio.run(
+        shard_run(scope, [it.model_dump() for it in items[1:]], None, None, '')
+    )
+    results = json_loads(content)
+    assert count == 2
+    assert [it['status'] for it in results] == [200, 200]
+    assert [it['response']['data']['id'] for it in results] == [
+        str(it.pk) for it in child_entities[1:]
+    ]
+
+
+def test_bulk_metrics_merge():
+    bulk_metrics.reset()
+    bulk_metrics.observe('shard_wait', 2)
+    bulk_metrics.inc('shards')
+
+    # the counters of a worker process are added, the maximums are compared
+    bulk_metrics.merge(
+        {'shards': 2, 'shard_wait_count': 1, 'shard_wait_sum': 1, 'shard_wait_max': 1}
+    )
+    snapshot = bulk_metrics.snapshot()
+    assert snapshot['shards'] == 3
+    assert snapshot['shard_wait_count'] == 2
+    assert snapshot['shard_wait_sum'] == 3
+    assert snapshot['shard_wait_max'] == 2
+
+
+def test_bulk_processes_pool(settings):
+    settings.BAZIS_BULK_PROCESSES = 2
+    settings.BAZIS_BULK_PROCESSES_SHARD_SIZE = 2
+
+    # the endpoints are not found, so the workers do not use the database
+    items = [
+        BulkRequestItemSchema(endpoint=f'/api/v1/missing/{i}/', method='GET') for i in range(5)
+    ]
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'scheme': 'http',
+        'server': ('testserver', 80),
+        'client': ('testclient', 50000),
+        'method': 'POST',
+        'path': '/api/v1/bulk/',
+        'query_string': b'is_atomic=false',
+        'headers': [(b'host', b'testserver')],
+    }
+
+    async def run():
+        package = BulkPackage(
+            request=Request(scope, receive_empty),
+            app=FastAPI(),
+            state={},
+            items=items,
+            is_atomic=False,
+        )
+        results, status_code = await items_shard_execute(package)
+        try:
+            return status_code, json_loads(results.getvalue())
+        finally:
+            results.close()
+
+    cost_model.reset()
+    try:
+        # the shards are executed by the spawned workers and merged in the order of the items
+        status_code, results = asyncio.run(run())
+        assert status_code == 200
+        assert [it['endpoint'] for it in results] == [it.endpoint for it in items]
+        assert {it['status'] for it in results} == {404}
+
+        # the durations observed by the workers are learned by the process of the package
+        assert {f'GET {it.endpoint}' for it in items} <= set(cost_model.averages)
+
+        # the worker that died breaks the pool, the package fails and the pool is dropped
+        pool = processes.process_pool
+        with pytest.raises(BrokenProcessPool):
+            pool.submit(os._exit, 1).result()
+        with pytest.raises(BrokenProcessPool):
+            asyncio.run(run())
+        assert processes.process_pool is None
+
+        # the next package starts a new pool
+        status_code, results = asyncio.run(run())
+        assert status_code == 200
+        assert processes.process_pool not in (None, pool)
+    finally:
+        if processes.process_pool is not None:
+            process_pool_reset(processes.process_pool)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_groups(sample_app):
+    child_entity = factories.ChildEntityFactory.create(child_name='Child test name')
+    endpoint = '/api/v1/entity/child_entity/'
+
+    def item_add(name, group):
+        return {
+            'endpoint': endpoint,
+            'method': 'POST',
+            'group': group,
+            'body': {
+                'data': {
+                    'type': 'entity.child_entity',
+                    'bs:action': 'add',
+                    'attributes': {'child_name': name},
+                },
+            },
+        }
+
+    request_data = [
+        item_add('Group name a', 'a'),
+        item_add('Group name b', 'b'),
+        {'endpoint': f'{endpoint}{child_entity.pk}/', 'method': 'GET'},
+        # the missing resource fails the group
+        {'endpoint': f'{endpoint}{uuid.uuid4()}/', 'method': 'GET', 'group': 'b'},
+    ]
+
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 207
+    assert json_loads(bulk_response.headers['X-Bulk-Groups']) == {
+        'a': 'committed',
+        'b': 'rolled_back',
+        '': 'committed',
+    }
+
+    # the results are in the order of the items
+    bulk_data = bulk_response.json()
+    assert [it['status'] for it in bulk_data] == [201, 201, 200, 404]
+    assert bulk_data[0]['response']['data']['attributes']['child_name'] == 'Group name a'
+
+    # the failed group is rolled back alone
+    assert ChildEntity.objects.filter(child_name='Group name a').exists()
+    assert not ChildEntity.objects.filter(child_name='Group name b').exists()
+
+    # the invalid item fails its group only, the pre-flight validation is run by the groups
+    request_data = [
+        item_add('Preflight name a', 'a'),
+        item_add('Preflight name b', 'b'),
+        {'endpoint': '/api/v1/entity/unknown_entity/', 'method': 'GET', 'group': 'b'},
+    ]
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 207
+    assert [it['status'] for it in bulk_response.json()] == [201, 424, 404]
+    assert ChildEntity.objects.filter(child_name='Preflight name a').exists()
+    assert not ChildEntity.objects.filter(child_name='Preflight name b').exists()
+
+    # the empty name of the group would be mixed up with the items without the group
+    request_data = [
+        item_add('Empty group name', ''),
+        {'endpoint': f'{endpoint}{child_entity.pk}/', 'method': 'GET'},
+    ]
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert bulk_response.status_code == 422
+    assert not ChildEntity.objects.filter(child_name='Empty group name').exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_bulk_diagnostics(sample_app, settings):
+    factories.ParentEntityFactory.create_batch(5, child_entities=True)
+    request_data = [
+        {'endpoint': '/api/v1/entity/parent_entity/', 'method': 'GET'},
+        {'endpoint': '/api/v1/entity/child_entity/', 'method': 'GET'},
+    ]
+
+    # the diagnostic mode is off by default
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?diagnostics=true', json_data=request_data
+    )
+    assert bulk_response.status_code == 400
+    bulk_response = get_api_client(sample_app).post('/api/v1/bulk/', json_data=request_data)
+    assert all('diagnostics' not in it for it in bulk_response.json())
+
+    # the statements with the same shape differ by the values only
+    assert sql_normalize('SELECT "id" FROM "a"  WHERE "pid" = %s AND "x" IN (%s, %s)') == (
+        'SELECT "id" FROM "a" WHERE "pid" = ? AND "x" IN (...)'
+    )
+
+    settings.BAZIS_BULK_DIAGNOSTICS = True
+    settings.BAZIS_BULK_DIAGNOSTICS_REPEATS = 1
+    bulk_response = get_api_client(sample_app).post(
+        '/api/v1/bulk/?diagnostics=true&is_atomic=false', json_data=request_data
+    )
+    assert bulk_response.status_code == 200
+
+    # every item reports its own statements
+    for it in bulk_response.json():
+        assert it['status'] == 200
+        diagnostics = it['diagnostics']
+        assert diagnostics['queries'] > 0
+        assert diagnostics['queries'] == sum(shape['count'] for shape in diagnostics['repeated'])
+        assert all('%s' not in shape['sql'] for shape in diagnostics['repeated'])
+
+
+def test_bulk_identity_headers():
+    # the identity headers of an item are dropped, whatever their case
+    headers_item = headers_encode(
+        [('Authorization', 'Bearer forged'), ('COOKIE', 'token=forged'), ('X-Trace', '1')]
+    )
+    assert headers_item == [(b'x-trace', b'1')]
+
+    # the sub-request keeps the identity of the package request
+    headers = headers_merge(
+        [(b'authorization', b'Bearer package'), (b'content-length', b'10')], headers_item
+    )
+    assert headers == [(b'authorization', b'Bearer package'), (b'x-trace', b'1')]
+
+
+def test_bulk_identity_overrides(monkeypatch, caplog):
+    calls = []
+
+    def get_token_data(token_header=None, token_param=None, token_cookie=None):
+        calls.append(token_header)
+        return {'sub': token_header}
+
+    def get_user_from_token(token_data):
+        return token_data['sub']
+
+    service = SimpleNamespace(
+        get_token_data=get_token_data, get_user_from_token=get_user_from_token
+    )
+    monkeypatch.setattr(auth, 'users_service_get', lambda: service)
+
+    app = FastAPI()
+    identity_overrides_install(app)
+    token_data_get = app.dependency_overrides[get_token_data]
+    user_from_token_get = app.dependency_overrides[get_user_from_token]
+
+    def request_make(state):
+        return Request({'type': 'http', 'headers': [], 'state': state})
+
+    # the sub-request takes the identity of the package request from the scope state,
+    # its own token is not decoded
+    identity = BulkIdentity(token_data={'sub': 'package'}, user='package')
+    request = request_make({BULK_IDENTITY: identity})
+    assert identity_from_scope(request) is identity
+    assert token_data_get(request, 'forged', None, None) == {'sub': 'package'}
+    assert user_from_token_get(request, {'sub': 'forged'}) == 'package'
+    assert not calls
+
+    # the invalid token of the package request fails the sub-requests
+    error = ValueError('invalid token')
+    request = request_make({BULK_IDENTITY: BulkIdentity(error=error)})
+    with pytest.raises(ValueError):
+        token_data_get(request, None, None, None)
+    with pytest.raises(ValueError):
+        user_from_token_get(request, {})
+
+    # outside the bulk the original dependencies are called
+    request = request_make({})
+    assert identity_from_scope(request) is None
+    assert token_data_get(request, 'own', None, None) == {'sub': 'own'}
+    assert user_from_token_get(request, {'sub': 'own'}) == 'own'
+    assert calls == ['own']
+
+    # the override of the project is kept with a warning, the repeated install keeps the own ones
+    identity_overrides_install(app)
+    assert app.dependency_overrides[get_token_data] is token_data_get
+    app = FastAPI()
+    app.dependency_overrides[get_user_from_token] = get_token_data
+    with caplog.at_level(logging.WARNING, logger=auth.__name__):
+        identity_overrides_install(app)
+    assert app.dependency_overrides[get_user_from_token] is get_token_data
+    assert 'get_user_from_token' in caplog.text
+
+
+def test_bulk_identity_overrides_signature(monkeypatch):
+    service = pytest.importorskip('bazis.contrib.users.service')
+    monkeypatch.setattr(auth, 'users_service_get', lambda: service)
+
+    app = FastAPI()
+    identity_overrides_install(app)
+
+    # the overrides take the parameters of the dependencies of bazis-users, and the request
+    for dependency in (service.get_token_data, service.get_user_from_token):
+        parameters = inspect.signature(dependency).parameters
+        parameters_override = inspect.signature(app.dependency_overrides[dependency]).parameters
+        assert list(parameters_override) == ['request', *parameters]
+        for name, parameter in parameters.items():
+            default = parameters_override[name].default
+            assert type(default) is type(parameter.default)
+            assert getattr(default, 'alias', None) == getattr(parameter.default, 'alias', None)